@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+"""
+asyncio client for the Mobilinkd TNC.
+
+AsyncTncModel drives a TNC from an asyncio event loop instead of a reader
+thread.  It uses TncModel to build commands and decode replies, so the
+command surface is the same, but each command is a coroutine.  The set_*
+coroutines complete once the command is handed to the port; the get_*
+coroutines complete when the TNC sends the matching reply.  One event
+loop can drive any number of TNCs.
+
+The port is non-blocking: it is read with loop.add_reader() and whatever
+it will not take at once is written from loop.add_writer(), so a stalled
+port never holds up the other TNCs on the loop.  This requires a POSIX
+system.
+"""
+
+import asyncio
+import os
+import serial
+
+from TncModel import HeadlessApp, TncModel
+
+
+def command(name):
+    """Return a coroutine method that sends TncModel.<name>()."""
+
+    async def method(self, *args):
+        self.headless.error = None
+        getattr(self.model, name)(*args)
+        self.headless.check()
+
+    method.__name__ = name
+    method.__doc__ = "Coroutine form of TncModel.%s()." % name
+    return method
+
+
+class AsyncTncModel(object):
+
+    TIMEOUT = TncModel.REQUEST_TIMEOUT
+
+    def __init__(self, device, app=None, loop=None, timeout=TIMEOUT):
+        self.device = device
+        self.app = app
+        self.loop = loop            # the running loop, if None, on connect()
+        self.timeout = timeout
+        # Keeps the latest value of each tnc_* callback in values (keyed
+        # without the 'tnc_' prefix) and passes the callbacks on to app.
+        self.headless = HeadlessApp(app)
+        self.values = self.headless.values
+        self.waiters = {}
+        self.ser = None
+        self.out_buffer = bytearray()   # not yet taken by the port
+        self.drained = None
+        self.model = TncModel(self.headless, device)
+        self.model.sio_writer = None
+
+    def connected(self):
+        return self.ser is not None
+
+    async def connect(self):
+        """Open the port and wait for the TNC to answer GET_ALL_VALUES.
+
+        Opening the port resets a TNC1/TNC2, so GET_ALL_VALUES is repeated
+        until the TNC answers or the timeout expires."""
+        if self.connected():
+            return
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        self.ser = serial.Serial(self.device, 38400, timeout=0)
+        os.set_blocking(self.ser.fileno(), False)
+        self.loop.add_reader(self.ser.fileno(), self.data_received)
+        self.model.sio_writer = self
+
+        try:
+            deadline = self.loop.time() + self.timeout
+            while True:
+                try:
+                    await self.get_all_values(timeout=.25)
+                    break
+                except asyncio.TimeoutError:
+                    if self.loop.time() >= deadline:
+                        raise
+            await self.set_ptt(False)
+        except Exception:
+            await self.disconnect()
+            raise
+
+    DRAIN_TIMEOUT = 1.0
+
+    async def disconnect(self):
+        if self.ser is None:
+            return
+        self.loop.remove_reader(self.ser.fileno())
+        try:
+            self.model.stream_audio_off()
+            try:
+                await self.drain(self.DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                # A stalled port; whatever it has not taken is dropped.
+                pass
+        finally:
+            self.loop.remove_writer(self.ser.fileno())
+            self.out_buffer = bytearray()
+            self.model.sio_writer = None
+            self.ser.close()
+            self.ser = None
+            for waiters in self.waiters.values():
+                for future in waiters:
+                    future.cancel()
+            self.waiters = {}
+
+    def write(self, data):
+        """Write data without blocking.  What the port does not take now is
+        kept and written when it is ready for more."""
+        if self.out_buffer:
+            self.out_buffer += data
+            return
+        try:
+            count = os.write(self.ser.fileno(), data)
+        except BlockingIOError:
+            count = 0
+        if count < len(data):
+            self.out_buffer += data[count:]
+            self.loop.add_writer(self.ser.fileno(), self.write_ready)
+
+    def write_ready(self):
+        fd = self.ser.fileno()
+        try:
+            count = os.write(fd, self.out_buffer)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            count = len(self.out_buffer)
+            self.model.app.exception(e)
+        del self.out_buffer[:count]
+        if not self.out_buffer:
+            self.loop.remove_writer(fd)
+            if self.drained is not None and not self.drained.done():
+                self.drained.set_result(None)
+
+    async def drain(self, timeout=None):
+        """Wait until the port has taken everything written.  Raises
+        asyncio.TimeoutError if it has not after timeout seconds."""
+        if not self.out_buffer:
+            return
+        if self.drained is None or self.drained.done():
+            self.drained = self.loop.create_future()
+        await asyncio.wait_for(asyncio.shield(self.drained), timeout)
+
+    def flush(self):
+        # The port is flushed by the OS; waiting for it here (tcdrain)
+        # would block the event loop.
+        pass
+
+    def data_received(self):
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except serial.SerialException as e:
+            self.model.app.exception(e)
+            self.loop.remove_reader(self.ser.fileno())
+            return
+
+        for packet in self.model.decoder.feed(data):
+            key = (packet.packet_type, packet.sub_type)
+            self.model.handle_packet(packet)
+            for future in self.waiters.pop(key, ()):
+                if not future.done():
+                    future.set_result(packet)
+
+    async def request(self, command, timeout=None, replies=None):
+        """Send command and return the first packet matching one of the
+        (packet_type, sub_type) keys in replies, by default those listed for
+        command in TncModel.QUERY_REPLIES.  Raises asyncio.TimeoutError if
+        no reply arrives within timeout seconds."""
+        if self.ser is None:
+            raise IOError("%s is not connected" % self.device)
+        if replies is None:
+            replies = TncModel.QUERY_REPLIES[command]
+
+        future = self.loop.create_future()
+        for key in replies:
+            self.waiters.setdefault(key, []).append(future)
+        try:
+            self.write(self.model.encoder.encode_cached(command))
+            return await asyncio.wait_for(
+                future, timeout if timeout is not None else self.timeout)
+        finally:
+            for key in replies:
+                waiters = self.waiters.get(key)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self.waiters[key]
+
+    @property
+    def api_version(self):
+        return self.model.api_version
+
+    async def get_all_values(self, timeout=None):
+        """Request all settings and return a dict of the values received so
+        far, keyed as in values."""
+        await self.request(TncModel.GET_ALL_VALUES, timeout)
+        return dict(self.values)
+
+    async def get_battery_level(self, timeout=None):
+        await self.request(TncModel.GET_BATTERY_LEVEL, timeout)
+        return self.values['battery_level']
+
+    async def get_ptt_channel(self, timeout=None):
+        await self.request(TncModel.GET_PTT_CHANNEL, timeout)
+        return self.values['ptt_style']
+
+    set_tx_volume = command('set_tx_volume')
+    set_tx_twist = command('set_tx_twist')
+    set_input_atten = command('set_input_atten')
+    set_squelch_level = command('set_squelch_level')
+    set_input_gain = command('set_input_gain')
+    set_input_twist = command('set_input_twist')
+    adjust_input = command('adjust_input')
+    set_tx_delay = command('set_tx_delay')
+    set_persistence = command('set_persistence')
+    set_time_slot = command('set_time_slot')
+    set_tx_tail = command('set_tx_tail')
+    set_duplex = command('set_duplex')
+    set_conn_track = command('set_conn_track')
+    set_verbosity = command('set_verbosity')
+    set_passall = command('set_passall')
+    set_rx_reverse_polarity = command('set_rx_reverse_polarity')
+    set_tx_reverse_polarity = command('set_tx_reverse_polarity')
+    set_modem_type = command('set_modem_type')
+    set_usb_on = command('set_usb_on')
+    set_usb_off = command('set_usb_off')
+    save_eeprom_settings = command('save_eeprom_settings')
+    set_ptt_channel = command('set_ptt_channel')
+    set_mark = command('set_mark')
+    set_space = command('set_space')
+    set_ptt = command('set_ptt')
+    stream_audio_on = command('stream_audio_on')
+    stream_audio_off = command('stream_audio_off')
@@ -18,7 +18,8 @@ class FirmwareSegment(object):
         
         self.memory_type = memory_type
         self.address = address
-        self.data = data
+        # Immutable, so that one Firmware can be shared by several loaders.
+        self.data = bytes(bytearray(data))
     
     def __len__(self):
         return len(self.data)
@@ -73,10 +74,15 @@ class Firmware(object):
 
 class BootLoader(object):
     
-    def __init__(self, reader, writer, filename, gui = None):
+    def __init__(self, reader, writer, firmware, gui = None):
+        """firmware is either the name of an Intel hex file or a Firmware
+        object, which may be shared with other BootLoader instances."""
         self.avr109 = None
         self.reader = reader
-        self.firmware = Firmware(filename)
+        if isinstance(firmware, Firmware):
+            self.firmware = firmware
+        else:
+            self.firmware = Firmware(firmware)
         self.gui = gui
         self.avr109 = Avr109(reader, writer)
         self.initialize()
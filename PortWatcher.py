@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""
+Keep track of serial ports as they are plugged in and removed.
+
+PortWatcher lists the serial ports once when it starts and after that
+follows the creation and removal of device nodes in /dev with inotify, so
+each change costs a single event and nothing is rescanned periodically.
+Subscribers are called with ('add', device) or ('remove', device).
+
+inotify is only available on Linux; elsewhere available() returns False
+and the port list has to be enumerated as before.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import glob
+import os
+import select
+import struct
+import sys
+import threading
+import traceback
+
+from serial.tools import list_ports
+
+libc = None
+if sys.platform.startswith('linux'):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+            use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        libc = None
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def available():
+    """Return True if ports can be watched on this system."""
+    return libc is not None
+
+
+def list_serial_ports():
+    """Return the set of serial ports present now."""
+    ports = set(port.device for port in list_ports.comports())
+    if os.name == 'posix':
+        ports.update(glob.glob('/dev/rfcomm*'))
+    return ports
+
+
+class PortWatcher(object):
+    """Watches DIRECTORY for device nodes whose names match PATTERNS.
+
+    Subscribers are called on the watcher thread; a GUI should hand the
+    event to its main loop (e.g. with GLib.idle_add).  Note that udev may
+    still be setting the permissions of a port when it is reported."""
+
+    DIRECTORY = '/dev'
+    PATTERNS = ('ttyUSB*', 'ttyACM*', 'rfcomm*')
+
+    def __init__(self, directory=DIRECTORY, patterns=PATTERNS):
+        self.directory = directory
+        self.patterns = patterns
+        self.lock = threading.Lock()
+        self.ports = set()
+        self.subscribers = []
+        self.fd = None
+        self.wake_pipe = None
+        self.thd = None
+
+    def subscribe(self, callback, initial=True):
+        """Call callback(event, device) for each port added or removed.
+        If initial is True, callback is first called with 'add' for each
+        port already present."""
+        with self.lock:
+            self.subscribers.append(callback)
+            current = sorted(self.ports) if initial else []
+        for device in current:
+            callback('add', device)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers.remove(callback)
+
+    def start(self):
+        if not available():
+            raise OSError("inotify is not available on this system")
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+        path = self.directory.encode(sys.getfilesystemencoding())
+        if libc.inotify_add_watch(fd, path, mask) < 0:
+            e = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(e, os.strerror(e), self.directory)
+        self.fd = fd
+        self.wake_pipe = os.pipe()
+        # Enumerate after the watch is in place so that nothing is missed.
+        self.resync()
+        self.thd = threading.Thread(target=self.run)
+        self.thd.daemon = True
+        self.thd.start()
+
+    def stop(self):
+        if self.thd is None:
+            return
+        os.write(self.wake_pipe[1], b'\0')
+        self.thd.join()
+        self.thd = None
+        os.close(self.fd)
+        os.close(self.wake_pipe[0])
+        os.close(self.wake_pipe[1])
+        self.fd = None
+        self.wake_pipe = None
+
+    def matches(self, name):
+        for pattern in self.patterns:
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+        return False
+
+    def resync(self):
+        """Bring the port list up to date by enumerating the ports.  Only
+        needed at start and if the kernel's event queue overflowed."""
+        present = list_serial_ports()
+        with self.lock:
+            added = present - self.ports
+            removed = self.ports - present
+        for device in sorted(removed):
+            self.update('remove', device)
+        for device in sorted(added):
+            self.update('add', device)
+
+    def update(self, event, device):
+        with self.lock:
+            if event == 'add':
+                if device in self.ports:
+                    return
+                self.ports.add(device)
+            else:
+                if device not in self.ports:
+                    return
+                self.ports.discard(device)
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(event, device)
+            except Exception:
+                traceback.print_exc()
+
+    def run(self):
+        while True:
+            readable = select.select([self.fd, self.wake_pipe[0]], [], [])[0]
+            if self.wake_pipe[0] in readable:
+                return
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+            self.handle_events(data)
+
+    def handle_events(self, data):
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                self.resync()
+                continue
+            name = name.decode(sys.getfilesystemencoding(), 'replace')
+            device = os.path.join(self.directory, name)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if self.matches(name):
+                    self.update('add', device)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.update('remove', device)
+
+
+if __name__ == '__main__':
+
+    import time
+
+    watcher = PortWatcher()
+    watcher.subscribe(lambda event, device: print(event, device))
+    watcher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""
+Record the raw bytes exchanged with a TNC.
+
+A session file starts with an 8 byte magic string followed by records,
+each an 11 byte little-endian header and the bytes themselves:
+
+    uint64  monotonic time in microseconds
+    uint8   direction: RX (from the TNC), TX (to the TNC) or START
+    uint16  length of the data that follows
+
+Files are only ever appended to.  Each recording starts with a START
+record whose data is the wall-clock time (a little-endian double) at that
+monotonic time.  The fixed layout lets SessionReader walk a memory-mapped
+file without copying it.
+
+    python SessionRecorder.py session.bin
+"""
+
+from __future__ import print_function, unicode_literals
+
+import binascii
+import datetime
+import mmap
+import struct
+import sys
+import threading
+import time
+
+clock = getattr(time, 'monotonic', time.time)
+
+MAGIC = b'TNCSESS1'
+RECORD_HEADER = struct.Struct('<QBH')
+START_TIME = struct.Struct('<d')
+MAX_CHUNK = 0xffff
+
+RX = 0
+TX = 1
+START = 2
+
+DIRECTIONS = {RX: 'rx', TX: 'tx', START: 'start'}
+
+
+class SessionRecorder(object):
+    """Appends records to a session file.  record() only packs the chunk
+    into a memory buffer, so it is cheap enough for the reader thread; a
+    separate thread writes the buffer out every FLUSH_INTERVAL seconds or
+    once FLUSH_SIZE bytes are waiting.  If more than max_buffer bytes are
+    waiting (the disk cannot keep up) chunks are dropped and counted in
+    dropped rather than blocking the caller."""
+
+    FLUSH_INTERVAL = 1.0
+    FLUSH_SIZE = 64 * 1024
+    MAX_BUFFER = 4 * 1024 * 1024
+
+    def __init__(self, filename, max_buffer=MAX_BUFFER):
+        self.filename = filename
+        self.max_buffer = max_buffer
+        self.file = open(filename, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.buffer = bytearray()
+        self.condition = threading.Condition()
+        self.running = True
+        self.bytes_recorded = 0
+        self.dropped = 0
+        self.record(START, START_TIME.pack(time.time()))
+        self.thd = threading.Thread(target=self.run)
+        self.thd.daemon = True
+        self.thd.start()
+
+    def record(self, direction, data):
+        timestamp = int(clock() * 1000000)
+        size = len(data)
+        with self.condition:
+            if not self.running:
+                return
+            if len(self.buffer) + size > self.max_buffer:
+                self.dropped += size
+                return
+            if size <= MAX_CHUNK:
+                self.buffer += RECORD_HEADER.pack(timestamp, direction, size)
+                self.buffer += data
+            else:
+                for pos in range(0, size, MAX_CHUNK):
+                    chunk = data[pos:pos + MAX_CHUNK]
+                    self.buffer += RECORD_HEADER.pack(timestamp, direction, len(chunk))
+                    self.buffer += chunk
+            self.bytes_recorded += size
+            if len(self.buffer) >= self.FLUSH_SIZE:
+                self.condition.notify()
+
+    def record_rx(self, data):
+        self.record(RX, data)
+
+    def record_tx(self, data):
+        self.record(TX, data)
+
+    def run(self):
+        while True:
+            with self.condition:
+                if self.running and len(self.buffer) < self.FLUSH_SIZE:
+                    self.condition.wait(self.FLUSH_INTERVAL)
+                data = self.buffer
+                self.buffer = bytearray()
+                running = self.running
+            if data:
+                self.file.write(data)
+                self.file.flush()
+            if not running:
+                return
+
+    def close(self):
+        """Write out anything buffered and close the file."""
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify()
+        self.thd.join()
+        self.file.close()
+
+
+class SessionReader(object):
+    """Reads a session file through mmap.  Iterating yields
+    (time, direction, data) for each record, where time is the monotonic
+    time in seconds and data is a memoryview into the file.  A record cut
+    short (e.g. by a crash while recording) ends the iteration."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.map.close()
+            raise ValueError("%s is not a TNC session file" % filename)
+
+    def __iter__(self):
+        view = memoryview(self.map)
+        size = len(view)
+        pos = len(MAGIC)
+        header_size = RECORD_HEADER.size
+        while pos + header_size <= size:
+            timestamp, direction, length = RECORD_HEADER.unpack_from(view, pos)
+            pos += header_size
+            if pos + length > size:
+                break
+            yield timestamp / 1000000.0, direction, view[pos:pos + length]
+            pos += length
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # Records handed out are still referenced; the mapping is
+            # released along with them.
+            pass
+
+
+def dump(filename, out=sys.stdout):
+    """Print the records in a session file."""
+    reader = SessionReader(filename)
+    start = None
+    for timestamp, direction, data in reader:
+        if direction == START:
+            start = timestamp
+            wall = datetime.datetime.fromtimestamp(START_TIME.unpack(data)[0])
+            print("--- session started %s" % wall.isoformat(), file=out)
+            continue
+        print("%10.6f %s %s" % (timestamp - (start or 0),
+            DIRECTIONS.get(direction, '?'),
+            binascii.hexlify(bytes(data)).decode('ascii')), file=out)
+    reader.close()
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2:
+        print("Usage: %s <session file>" % sys.argv[0])
+        sys.exit(1)
+    dump(sys.argv[1])
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+Play a recorded session back through TncModel.
+
+The bytes the TNC sent (the RX records of a SessionRecorder file) are fed
+through the model's KissDecode and delivered to its handlers exactly as
+the reader thread would, so field problems can be reproduced without the
+hardware.  Playback can follow the recorded timing, run N times faster,
+or go as fast as possible to measure decode and dispatch throughput.
+
+    python SessionReplay.py session.bin            # as fast as possible
+    python SessionReplay.py --speed 1 session.bin  # in real time
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import sys
+import time
+
+from SessionRecorder import SessionReader, RX, START
+from TncModel import HeadlessApp, TncModel, call_now, clock
+
+
+def replay_model(app=None):
+    """Return a TncModel, not connected to any port, that handles packets
+    as soon as they are delivered.  app defaults to a new HeadlessApp,
+    which counts the callbacks."""
+    model = TncModel(app if app is not None else HeadlessApp(), None)
+    model.idle_add = call_now
+    return model
+
+
+def replay(filename, model=None, speed=None):
+    """Feed the received bytes recorded in filename to model (by default
+    replay_model()).  With speed None or 0 the bytes are fed as fast as
+    possible; otherwise the recorded timing is followed, speed times
+    faster.  Gaps between sessions appended to one file are skipped.
+
+    Packets go through model.deliver_packets(), so a model attached to a
+    running GLib main loop has its handlers called there.  Returns a dict
+    with the 'bytes', 'chunks' and 'packets' replayed and the 'elapsed'
+    time."""
+    if model is None:
+        model = replay_model()
+    decoder = model.decoder
+    reader = SessionReader(filename)
+    byte_count = chunk_count = packet_count = 0
+    base = None
+    start = clock()
+    try:
+        for timestamp, direction, data in reader:
+            if direction == START:
+                base = None
+                continue
+            if direction != RX:
+                continue
+            if speed:
+                now = clock()
+                if base is None:
+                    base = (timestamp, now)
+                else:
+                    delay = base[1] + (timestamp - base[0]) / speed - now
+                    if delay > 0:
+                        time.sleep(delay)
+            packets = decoder.feed(data)
+            if packets:
+                model.deliver_packets(packets)
+                packet_count += len(packets)
+            byte_count += len(data)
+            chunk_count += 1
+    finally:
+        reader.close()
+    return dict(bytes = byte_count, chunks = chunk_count,
+        packets = packet_count, elapsed = clock() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded TNC session through TncModel.")
+    parser.add_argument('session', help="session file from SessionRecorder")
+    parser.add_argument('--speed', type=float, default=None,
+        help="play back N times faster than recorded (default: as fast "
+            "as possible)")
+    parser.add_argument('--repeat', type=int, default=1,
+        help="replay the session N times")
+    args = parser.parse_args(argv)
+
+    sink = HeadlessApp()
+    model = replay_model(sink)
+    totals = dict(bytes = 0, chunks = 0, packets = 0, elapsed = 0.0)
+    for i in range(args.repeat):
+        for key, value in replay(args.session, model, args.speed).items():
+            totals[key] += value
+
+    elapsed = totals['elapsed'] or 1e-9
+    print("%d bytes, %d chunks, %d packets in %.3fs" % (totals['bytes'],
+        totals['chunks'], totals['packets'], totals['elapsed']))
+    print("%.0f packets/s, %.0f bytes/s" % (totals['packets'] / elapsed,
+        totals['bytes'] / elapsed))
+    for name in sorted(sink.counts):
+        print("  tnc_%-28s %d" % (name, sink.counts[name]))
+    for e in sink.exceptions:
+        print("exception: %s" % e, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""
+A simulated XBoot++ (AVR109) bootloader on a pseudo-terminal.
+
+SimulatedBootLoader answers the subset of AVR109 that Avr109 and
+BootLoader use -- S p V a b t s A B g e P L E -- and keeps the flash of an
+ATmega 328P in memory, so that a complete upload and verify can be timed
+and the result compared byte for byte with the image.  Chip erase and
+page writes take as long as Atmega328p.erase_delay (microseconds) and
+Atmega328p.exec_delay (milliseconds) say, scaled by time_scale.
+
+On a TNC, opening the port resets it into the bootloader.  A pty cannot
+see that, so here ESC re-enters the bootloader after 'E'.
+
+This uses the pty module and therefore requires a POSIX system.
+
+    python3 SimulatedBootLoader.py firmware.hex
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import pty
+import select
+import sys
+import threading
+import time
+import tty
+from struct import pack
+
+import Atmega328p
+
+
+class SimulatorStopped(Exception):
+    pass
+
+
+class SimulatedBootLoader(object):
+
+    FLASH_SIZE = 32 * 1024
+    BLOCK_SIZE = 128
+    SOFTWARE_VERSION = b'17'
+    DEVICE_CODES = b'\x74'
+
+    def __init__(self, time_scale=1.0):
+        self.time_scale = time_scale
+        self.erase_delay = Atmega328p.erase_delay / 1000000.0
+        self.page_delay = Atmega328p.exec_delay / 1000.0
+        self.signature = bytes(bytearray(reversed(Atmega328p.signature)))
+        self.flash = bytearray(b'\xff' * self.FLASH_SIZE)
+        self.address = 0
+        self.program_mode = False
+        self.active = True
+        self.commands = {}
+        self.pages_written = 0
+        self.erase_count = 0
+        self.thd = None
+
+    def start(self):
+        """Open the pty and start answering.  Returns the device name."""
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.device = os.ttyname(self.slave)
+        self.wake_pipe = os.pipe()
+        self.running = True
+        self.thd = threading.Thread(target=self.run)
+        self.thd.daemon = True
+        self.thd.start()
+        return self.device
+
+    def stop(self):
+        if self.thd is None:
+            return
+        self.running = False
+        os.write(self.wake_pipe[1], b'\0')
+        self.thd.join()
+        self.thd = None
+        for fd in (self.master, self.slave) + self.wake_pipe:
+            os.close(fd)
+
+    def image(self):
+        return bytes(self.flash)
+
+    def compare(self, firmware):
+        """Return the address of the first byte of firmware (a
+        BootLoader.Firmware) that differs from the flash, or None if the
+        flash holds the whole image."""
+        for segment in firmware:
+            data = bytearray(segment.data)
+            end = segment.address + len(data)
+            if self.flash[segment.address:end] != data:
+                for i, byte in enumerate(data):
+                    if self.flash[segment.address + i] != byte:
+                        return segment.address + i
+        return None
+
+    def read(self, size):
+        data = bytearray()
+        while len(data) < size:
+            readable = select.select([self.master, self.wake_pipe[0]], [], [])[0]
+            if not self.running:
+                raise SimulatorStopped()
+            if self.master in readable:
+                data += os.read(self.master, size - len(data))
+        return data
+
+    def write(self, data):
+        os.write(self.master, data)
+
+    def delay(self, seconds):
+        if self.time_scale:
+            time.sleep(seconds * self.time_scale)
+
+    def run(self):
+        try:
+            while True:
+                command = self.read(1)
+                self.commands[bytes(command)] = self.commands.get(bytes(command), 0) + 1
+                if command == b'\x1b':
+                    self.active = True
+                elif self.active:
+                    self.handle(command)
+        except (SimulatorStopped, OSError):
+            pass
+
+    def handle(self, command):
+        if command == b'S':
+            self.write(b'XBoot++')
+        elif command == b'p':
+            self.write(b'S')
+        elif command == b'V':
+            self.write(self.SOFTWARE_VERSION)
+        elif command == b'a':
+            self.write(b'Y')
+        elif command == b'b':
+            self.write(b'Y' + pack('>H', self.BLOCK_SIZE))
+        elif command == b't':
+            self.write(self.DEVICE_CODES + b'\0')
+        elif command == b's':
+            self.write(self.signature)
+        elif command == b'A':
+            high, low = self.read(2)
+            self.address = ((high << 8) | low) * 2
+            self.write(b'\r')
+        elif command == b'B':
+            high, low, memtype = self.read(3)
+            data = self.read((high << 8) | low)
+            self.write_block(memtype, data)
+        elif command == b'g':
+            high, low, memtype = self.read(3)
+            size = (high << 8) | low
+            end = min(self.address + size, self.FLASH_SIZE)
+            self.write(bytes(self.flash[self.address:end]))
+            self.address = end
+        elif command == b'e':
+            self.flash[:] = b'\xff' * self.FLASH_SIZE
+            self.erase_count += 1
+            self.delay(self.erase_delay)
+            self.write(b'\r')
+        elif command in (b'P', b'L'):
+            self.program_mode = command == b'P'
+            self.write(b'\r')
+        elif command == b'E':
+            self.active = False
+            self.write(b'\r')
+        else:
+            self.write(b'?')
+
+    def write_block(self, memtype, data):
+        if memtype != ord('F'):
+            # Only flash is modelled; EEPROM writes are accepted and lost.
+            self.write(b'\r')
+            return
+        # Each page is erased and written as a whole.
+        end = min(self.address + len(data), self.FLASH_SIZE)
+        self.flash[self.address:end] = data[:end - self.address]
+        pages = (len(data) + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE
+        self.pages_written += pages
+        self.delay(self.page_delay * pages)
+        self.address = end
+        self.write(b'\r')
+
+
+def main(argv=None):
+    import serial
+    from BootLoader import BootLoader, Firmware
+
+    parser = argparse.ArgumentParser(
+        description="Time an upload and verify against a simulated bootloader.")
+    parser.add_argument('firmware', help="Intel hex firmware image")
+    parser.add_argument('--time-scale', type=float, default=1.0,
+        help="multiply the erase and page write delays (0 for none)")
+    args = parser.parse_args(argv)
+
+    firmware = Firmware(args.firmware)
+    simulator = SimulatedBootLoader(args.time_scale)
+    device = simulator.start()
+    ser = serial.Serial(device, 38400, timeout=.1)
+    start = time.time()
+    try:
+        bootloader = BootLoader(ser, ser, firmware)
+        bootloader.load()
+        verified = bootloader.verify()
+        bootloader.exit()
+    finally:
+        ser.close()
+        simulator.stop()
+    elapsed = time.time() - start
+
+    mismatch = simulator.compare(firmware)
+    print("%d bytes, %d pages in %.2fs; verify %s; flash %s" % (
+        len(firmware), simulator.pages_written, elapsed,
+        "passed" if verified else "FAILED",
+        "matches" if mismatch is None else "differs at %04X" % mismatch))
+    return 0 if verified and mismatch is None else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+"""
+A simulated Mobilinkd TNC on a pseudo-terminal.
+
+SimulatedTnc opens a pty and answers the KISS hardware commands TncModel
+sends: GET_ALL_VALUES, the setters, battery and PTT channel queries and
+POLL_VOLUME/STREAM_VOLUME, so that the connect, dispatch and throughput
+paths can be exercised and timed without a TNC.  It can behave like API
+1.0 (TNC1/TNC2) or API 2.0 (TNC3) firmware, delay its replies, ignore
+input while "booting" and corrupt the bytes it sends with a seeded random
+generator, so runs are reproducible.
+
+This uses the pty module and therefore requires a POSIX system.
+
+    python3 SimulatedTnc.py --api 2.0 --rate 50
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import heapq
+import os
+import pty
+import random
+import select
+import sys
+import threading
+import time
+import tty
+from struct import pack
+
+from TncModel import TncModel, KissDecode, KissEncode, clock
+
+T = TncModel
+
+
+class SimulatedTnc(object):
+    """A TNC on a pty.  Connect to device once start() has returned.
+
+    api_version is 0x0100 or 0x0200.  stream_rate is the number of input
+    level reports per second sent after STREAM_VOLUME.  Every frame sent is
+    delayed by latency seconds.  noise is the probability of each byte sent
+    being replaced by a random one.  Input is ignored for boot_delay
+    seconds after start(), as a TNC1/TNC2 does after the port resets it."""
+
+    DEFAULTS = {
+        'tx_delay': 30, 'persistence': 63, 'slot_time': 10, 'tx_tail': 2,
+        'duplex': 0, 'tx_volume': 128, 'tx_twist': 50, 'input_atten': 0,
+        'input_gain': 0, 'input_twist': 6, 'squelch_level': 2,
+        'verbosity': 0, 'conn_track': 0, 'usb_power_on': 1,
+        'usb_power_off': 1, 'ptt_channel': 0, 'passall': 0,
+        'rx_reverse_polarity': 0, 'tx_reverse_polarity': 0, 'modem_type': 1,
+    }
+
+    # KISS parameter commands (packet type) and the setting they change.
+    KISS_PARAMETERS = {
+        1: 'tx_delay', 2: 'persistence', 3: 'slot_time', 4: 'tx_tail',
+        5: 'duplex',
+    }
+
+    # One byte hardware setters (sub_type) and the setting they change.
+    BYTE_SETTERS = {
+        0x1a: 'tx_twist', 0x18: 'input_twist', 0x03: 'squelch_level',
+        0x10: 'verbosity', 0x45: 'conn_track', 0x49: 'usb_power_on',
+        0x4b: 'usb_power_off', 0x4f: 'ptt_channel', 0x51: 'passall',
+        0x53: 'rx_reverse_polarity', 0x55: 'tx_reverse_polarity',
+    }
+
+    def __init__(self, api_version=0x0200, stream_rate=10.0, latency=0.0,
+            noise=0.0, boot_delay=0.0, seed=0,
+            capabilities=T.CAP_EEPROM_SAVE | T.CAP_ADJUST_INPUT):
+        self.api_version = api_version
+        self.stream_rate = stream_rate
+        self.latency = latency
+        self.noise = noise
+        self.boot_delay = boot_delay
+        self.capabilities = capabilities
+        self.random = random.Random(seed)
+        self.firmware_version = '2.1.0' if api_version >= 0x0200 else '0.8.5'
+        self.hardware_version = 'TNC3 2.1.1' if api_version >= 0x0200 else 'TNC2'
+        self.serial_number = 'SIM%05d' % self.random.randrange(100000)
+        self.mac_address = bytes(bytearray(
+            [0x34, 0x81, 0xf4] + [self.random.randrange(256) for i in range(3)]))
+        self.battery_level = 3900
+        self.settings = dict(self.DEFAULTS)
+        self.ptt = T.PTT_OFF
+        self.saved = 0
+        self.streaming = False
+        self.commands = {}          # (packet_type, sub_type) -> count
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.decoder = KissDecode()
+        self.encoder = KissEncode()
+        self.outbox = []            # heap of (due, sequence, frame)
+        self.sequence = 0
+        self.device = None
+        self.master = None
+        self.slave = None
+        self.thd = None
+
+    def start(self):
+        """Open the pty and start answering.  Returns the device name."""
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        # The slave end stays open here so that the master does not see
+        # EIO while no client has the port open.
+        self.device = os.ttyname(self.slave)
+        self.wake_pipe = os.pipe()
+        self.started = clock()
+        self.running = True
+        self.thd = threading.Thread(target=self.run)
+        self.thd.daemon = True
+        self.thd.start()
+        return self.device
+
+    def stop(self):
+        if self.thd is None:
+            return
+        self.running = False
+        os.write(self.wake_pipe[1], b'\0')
+        self.thd.join()
+        self.thd = None
+        for fd in (self.master, self.slave) + self.wake_pipe:
+            os.close(fd)
+
+    def run(self):
+        next_level = None
+        while self.running:
+            now = clock()
+            timeouts = []
+            if self.outbox:
+                timeouts.append(self.outbox[0][0] - now)
+            if self.streaming:
+                if next_level is None:
+                    next_level = now
+                timeouts.append(next_level - now)
+            timeout = max(0, min(timeouts)) if timeouts else None
+            readable = select.select(
+                [self.master, self.wake_pipe[0]], [], [], timeout)[0]
+            if self.wake_pipe[0] in readable:
+                os.read(self.wake_pipe[0], 64)
+            if self.master in readable:
+                data = os.read(self.master, 4096)
+                if clock() - self.started >= self.boot_delay:
+                    for packet in self.decoder.feed(data):
+                        self.handle(packet)
+            now = clock()
+            if not self.streaming:
+                next_level = None
+            else:
+                if next_level is None:
+                    next_level = now
+                if now >= next_level:
+                    self.reply(T.HANDLE_INPUT_LEVEL, pack('B', self.input_level()))
+                    next_level = max(next_level + 1.0 / self.stream_rate, now)
+            self.flush(now)
+
+    def input_level(self):
+        return self.random.randrange(16, 128)
+
+    def reply(self, handle, payload=b''):
+        self.send(bytes(bytearray([T.PACKET_TYPE_HARDWARE, handle])) + payload)
+
+    def send(self, data):
+        frame = self.encoder.encode(data)
+        self.sequence += 1
+        heapq.heappush(self.outbox, (clock() + self.latency, self.sequence, frame))
+
+    def flush(self, now):
+        out = bytearray()
+        while self.outbox and self.outbox[0][0] <= now:
+            out += heapq.heappop(self.outbox)[2]
+            self.frames_sent += 1
+        if not out:
+            return
+        if self.noise:
+            for i in range(len(out)):
+                if self.random.random() < self.noise:
+                    out[i] = self.random.randrange(256)
+        os.write(self.master, bytes(out))
+        self.bytes_sent += len(out)
+
+    def handle(self, packet):
+        key = (packet.packet_type, packet.sub_type)
+        self.commands[key] = self.commands.get(key, 0) + 1
+        data = packet.data
+        if packet.packet_type in self.KISS_PARAMETERS:
+            if data:
+                self.settings[self.KISS_PARAMETERS[packet.packet_type]] = data[0]
+            return
+        if packet.packet_type != T.PACKET_TYPE_HARDWARE:
+            return
+
+        sub_type = packet.sub_type
+        if sub_type == 0x7f:
+            self.send_all_values()
+        elif sub_type == T.HANDLE_BATTERY_LEVEL:
+            self.reply(T.HANDLE_BATTERY_LEVEL, pack('>H', self.battery_level))
+        elif sub_type == 0x04:
+            self.streaming = False
+            self.reply(T.HANDLE_INPUT_LEVEL, pack('B', self.input_level()))
+        elif sub_type == 0x05:
+            self.streaming = True
+        elif sub_type == 0x50:
+            self.reply(T.HANDLE_PTT_CHANNEL, pack('B', self.settings['ptt_channel']))
+        elif sub_type in (0x07, 0x08, 0x09, 0x0a):
+            self.ptt = bytes(bytearray([6, sub_type]))
+        elif sub_type == 0x2a:
+            self.saved += 1
+        elif sub_type == 0x2b:
+            self.settings['input_gain'] = 4
+        elif sub_type == 0x01 and data:
+            if self.api_version == 0x0100:
+                self.settings['tx_volume'] = data[0]
+            elif len(data) >= 2:
+                self.settings['tx_volume'] = (data[0] << 8 | data[1])
+        elif sub_type == 0x02 and data:
+            if self.api_version == 0x0100:
+                self.settings['input_atten'] = data[0]
+            elif len(data) >= 2:
+                self.settings['input_gain'] = (data[0] << 8 | data[1])
+        elif sub_type == T.HANDLE_EXTENDED_1 and len(data) >= 2:
+            if data[0] == 0x82:
+                self.settings['modem_type'] = data[1]
+        elif sub_type in self.BYTE_SETTERS and data:
+            self.settings[self.BYTE_SETTERS[sub_type]] = data[0]
+
+    def send_all_values(self):
+        s = self.settings
+        api2 = self.api_version >= 0x0200
+        if api2:
+            self.reply(T.HANDLE_API_VERSION, pack('>h', self.api_version))
+        self.reply(T.HANDLE_FIRMWARE_VERSION, self.firmware_version.encode('ascii'))
+        self.reply(T.HANDLE_HARDWARE_VERSION, self.hardware_version.encode('ascii'))
+        if api2:
+            self.reply(T.HANDLE_SERIAL_NUMBER, self.serial_number.encode('ascii'))
+        self.reply(T.HANDLE_MAC_ADDRESS, self.mac_address)
+        if api2:
+            self.reply(T.HANDLE_TX_VOLUME, pack('>h', s['tx_volume']))
+            self.reply(T.HANDLE_TX_TWIST, pack('B', s['tx_twist']))
+            self.reply(T.HANDLE_INPUT_GAIN, pack('>h', s['input_gain']))
+            self.reply(T.HANDLE_INPUT_TWIST, pack('B', s['input_twist']))
+        else:
+            self.reply(T.HANDLE_TX_VOLUME, pack('B', s['tx_volume'] & 0xff))
+            self.reply(T.HANDLE_INPUT_ATTEN, pack('B', s['input_atten']))
+        self.reply(T.HANDLE_SQUELCH_LEVEL, pack('B', s['squelch_level']))
+        self.reply(T.HANDLE_VERBOSITY, pack('B', s['verbosity']))
+        self.reply(T.HANDLE_TX_DELAY, pack('B', s['tx_delay']))
+        self.reply(T.HANDLE_PERSISTENCE, pack('B', s['persistence']))
+        self.reply(T.HANDLE_SLOT_TIME, pack('B', s['slot_time']))
+        self.reply(T.HANDLE_TX_TAIL, pack('B', s['tx_tail']))
+        self.reply(T.HANDLE_DUPLEX, pack('B', s['duplex']))
+        self.reply(T.HANDLE_CONNECTION_TRACKING, pack('B', s['conn_track']))
+        self.reply(T.HANDLE_USB_POWER_ON, pack('B', s['usb_power_on']))
+        self.reply(T.HANDLE_USB_POWER_OFF, pack('B', s['usb_power_off']))
+        self.reply(T.HANDLE_PTT_CHANNEL, pack('B', s['ptt_channel']))
+        if api2:
+            self.reply(T.HANDLE_MIN_INPUT_TWIST, pack('b', -3))
+            self.reply(T.HANDLE_MAX_INPUT_TWIST, pack('b', 9))
+            self.reply(T.HANDLE_MIN_INPUT_GAIN, pack('>h', 0))
+            self.reply(T.HANDLE_MAX_INPUT_GAIN, pack('>h', 4))
+            self.reply(T.HANDLE_PASSALL, pack('B', s['passall']))
+            self.reply(T.HANDLE_RX_REVERSE_POLARITY, pack('B', s['rx_reverse_polarity']))
+            self.reply(T.HANDLE_TX_REVERSE_POLARITY, pack('B', s['tx_reverse_polarity']))
+            self.reply(T.HANDLE_EXTENDED_1, pack('BB', T.HANDLE_EXT1_SELECTED_MODEM_TYPE,
+                s['modem_type']))
+            self.reply(T.HANDLE_EXTENDED_1, pack('BBBB', T.HANDLE_EXT1_SUPPORTED_MODEM_TYPES,
+                1, 2, 5))
+        self.reply(T.HANDLE_BATTERY_LEVEL, pack('>H', self.battery_level))
+        self.reply(T.HANDLE_CAPABILITIES, pack('<H', self.capabilities))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run a simulated Mobilinkd TNC on a pseudo-terminal.")
+    parser.add_argument('--api', choices=('1.0', '2.0'), default='2.0',
+        help="firmware API version to emulate (default: 2.0)")
+    parser.add_argument('--rate', type=float, default=10.0,
+        help="input level reports per second when streaming (default: 10)")
+    parser.add_argument('--latency', type=float, default=0.0,
+        help="seconds to delay each reply")
+    parser.add_argument('--noise', type=float, default=0.0,
+        help="probability of each byte sent being corrupted")
+    parser.add_argument('--boot-delay', type=float, default=0.0,
+        help="seconds to ignore input after starting")
+    parser.add_argument('--seed', type=int, default=0,
+        help="seed for the noise and level generator")
+    args = parser.parse_args(argv)
+
+    tnc = SimulatedTnc(0x0100 if args.api == '1.0' else 0x0200, args.rate,
+        args.latency, args.noise, args.boot_delay, args.seed)
+    print(tnc.start())
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    tnc.stop()
+    print("commands received:")
+    for key in sorted(tnc.commands, key=str):
+        print("  %s: %d" % (key, tnc.commands[key]))
+    print("%d frames, %d bytes sent" % (tnc.frames_sent, tnc.bytes_sent))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,6 @@
 import sys
 import os
 import gi
-import time
 
 # On Windows, when using cx_Freeze, the location of the typelib files are moved
 # to a non-standard location.  The GI_TYPELIB_PATH environment variable needs
@@ -20,6 +19,7 @@ from gi.repository import Gtk,Gdk,GLib,GObject,Notify
 import serial.tools.list_ports
 
 from TncModel import TncModel
+import PortWatcher
 
 def glade_location():
 
@@ -39,6 +39,7 @@ class TncConfigApp(object):
         self.tnc = None
         self.device_path = None
         self.connect_message = None
+        self.port_watcher = None
         
         self.builder = Gtk.Builder()
         self.builder.add_from_file(
@@ -108,6 +109,9 @@ class TncConfigApp(object):
         if self.tnc is not None:
             self.tnc.disconnect()
             self.tnc = None
+        if self.port_watcher is not None:
+            self.port_watcher.stop()
+            self.port_watcher = None
         Gtk.main_quit()
 
     def get_modem_number(self, modem_name):
@@ -128,8 +132,32 @@ class TncConfigApp(object):
         self.connect_button.set_sensitive(False)
         self.serial_port_combo_box_text = self.builder.get_object("serial_port_combo_box_text")
         assert(self.serial_port_combo_box_text is not None)
-        for port in serial.tools.list_ports.comports():
-            self.serial_port_combo_box_text.append_text(port[0])
+        if PortWatcher.available():
+            # Follow ports as they are plugged in and removed.
+            try:
+                self.port_watcher = PortWatcher.PortWatcher()
+                self.port_watcher.start()
+                self.port_watcher.subscribe(
+                    lambda event, device: GLib.idle_add(self.port_changed, event, device))
+            except OSError as e:
+                # E.g. the inotify instance limit reached; list them once.
+                print("Not watching for serial ports: %s" % e)
+                self.port_watcher.stop()
+                self.port_watcher = None
+        if self.port_watcher is None:
+            for port in serial.tools.list_ports.comports():
+                self.serial_port_combo_box_text.append_text(port[0])
+    
+    def port_changed(self, event, device):
+        combo = self.serial_port_combo_box_text
+        ports = [row[0] for row in combo.get_model()]
+        if event == 'add':
+            if device not in ports:
+                combo.append_text(device)
+        elif device in ports and device != self.device_path:
+            # The selected port is left in place; it may be in use.
+            combo.remove(ports.index(device))
+        return False
         
     def on_connect_button_toggled(self, widget):
     
@@ -194,12 +222,9 @@ class TncConfigApp(object):
         
         self.input_auto_adjust_button = self.builder.get_object("input_auto_adjust_button")
         self.input_auto_adjust_button.set_visible(False)
-        
-        self.last_audio_input_update_time = time.time()
 
     
     def on_audio_input_enter(self):
-        self.last_audio_input_update_time = 0
         if self.tnc is not None and self.connect_button.get_active():
             self.tnc.stream_audio_on()
         
@@ -213,24 +238,16 @@ class TncConfigApp(object):
         self.tnc.stream_audio_on()
     
     def on_input_gain_adjustment_value_changed(self, widget):
-        now = time.time()
-        if now - self.last_audio_input_update_time > 0.1:
-            self.tnc.set_input_gain(int(widget.get_value()))
-            self.last_audio_input_update_time = now
+        self.tnc.set_input_gain(int(widget.get_value()))
             
     def on_input_gain_scale_button_release_event(self, widget, data = None):
         self.tnc.set_input_gain(int(widget.get_value()))
-        self.last_audio_input_update_time = time.time()
     
     def on_input_twist_adjustment_value_changed(self, widget):
-        now = time.time()
-        if now - self.last_audio_input_update_time > 0.1:
-            self.tnc.set_input_twist(int(widget.get_value()))
-            self.last_audio_input_update_time = now
+        self.tnc.set_input_twist(int(widget.get_value()))
     
     def on_input_twist_scale_button_release_event(self, widget, event, data = None):
         self.tnc.set_input_twist(int(widget.get_value()))
-        self.last_audio_input_update_time = time.time()
     
     def on_input_auto_adjust_button_clicked(self, widget):
         self.tnc.adjust_input()
@@ -255,8 +272,6 @@ class TncConfigApp(object):
         self.space_tone_radio_button = self.builder.get_object("space_tone_radio_button")
         self.both_tone_radio_button = self.builder.get_object("both_tone_radio_button")
         self.transmit_toggle_button = self.builder.get_object("transmit_toggle_button")
-        
-        self.last_audio_output_update_time = time.time()
     
     def on_audio_output_enter(self):
         # print('on_audio_output_enter')
@@ -279,25 +294,16 @@ class TncConfigApp(object):
         pass
     
     def on_output_gain_adjustment_value_changed(self, widget):
-        now = time.time()
-        if now - self.last_audio_output_update_time >= .1:
-            # print('on_output_gain_adjustment_value_changed =', widget.get_value())
-            self.tnc.set_tx_volume(int(widget.get_value()))
-            self.last_audio_output_update_time = now
+        self.tnc.set_tx_volume(int(widget.get_value()))
 
     def on_output_gain_scale_button_release_event(self, widget, data = None):
         self.tnc.set_tx_volume(int(widget.get_value()))
-        self.last_audio_output_update_time = time.time()
 
     def on_output_twist_adjustment_value_changed(self, widget):
-        now = time.time()
-        if now - self.last_audio_output_update_time >= .1:
-            self.tnc.set_tx_twist(int(widget.get_value()))
-            self.last_audio_output_update_time = now
+        self.tnc.set_tx_twist(int(widget.get_value()))
 
     def on_output_twist_scale_button_release_event(self, widget, data = None):
         self.tnc.set_tx_twist(int(widget.get_value()))
-        self.last_audio_output_update_time = time.time()
 
     def on_mark_tone_radio_button_toggled(self, widget):
         if widget.get_active():
@@ -355,7 +361,6 @@ class TncConfigApp(object):
         self.slot_time_spin_button = self.builder.get_object("slot_time_spin_button")
         self.p_persist_spin_button = self.builder.get_object("p_persist_spin_button")
         self.full_duplex_check_button = self.builder.get_object("full_duplex_check_button")
-        self.last_kiss_parameter_update_time = time.time()
     
     def on_kiss_parameters_enter(self):
         # print('on_kiss_parameters_enter')
@@ -366,34 +371,22 @@ class TncConfigApp(object):
         pass
 
     def on_tx_delay_adjustment_value_changed(self, widget):
-        now = time.time()
-        if now - self.last_kiss_parameter_update_time >= .1:
-            self.tnc.set_tx_delay(int(widget.get_value()))
-            self.last_kiss_parameter_update_time = now
+        self.tnc.set_tx_delay(int(widget.get_value()))
    
     def on_tx_delay_spin_button_button_release_event(self, widget, event):
         self.tnc.set_tx_delay(int(widget.get_value()))
-        self.last_kiss_parameter_update_time = time.time()
 
     def on_slot_time_adjustment_value_changed(self, widget):
-        now = time.time()
-        if now - self.last_kiss_parameter_update_time >= .1:
-            self.tnc.set_time_slot(int(widget.get_value()))
-            self.last_kiss_parameter_update_time = now
+        self.tnc.set_time_slot(int(widget.get_value()))
 
     def on_slot_time_spin_button_button_release_event(self, widget, event):
         self.tnc.set_time_slot(int(widget.get_value()))
-        self.last_kiss_parameter_update_time = time.time()
 
     def on_p_persistence_adjustment_value_changed(self, widget):
-        now = time.time()
-        if now - self.last_kiss_parameter_update_time >= .1:
-            self.tnc.set_persistence(int(widget.get_value()))
-            self.last_kiss_parameter_update_time = now
+        self.tnc.set_persistence(int(widget.get_value()))
 
     def on_p_persist_spin_button_button_release_event(self, widget, event):
         self.tnc.set_persistence(int(widget.get_value()))
-        self.last_kiss_parameter_update_time = time.time()
         
     def on_full_duplex_check_button_toggled(self, widget):
         self.tnc.set_duplex(widget.get_active())
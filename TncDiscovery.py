@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+Find the serial ports that have a Mobilinkd TNC attached.
+
+Every candidate port (those pyserial lists, plus /dev/rfcomm* on POSIX) is
+opened at the same time and sent GET_ALL_VALUES.  The ports that answer
+with a valid KISS frame within the deadline are returned along with the
+versions, serial number and MAC address the TNC reports.
+
+Results are cached by device path and USB identity (vendor, product,
+serial number and location), so a rescan only probes ports that are new
+or have had a different device plugged in.
+
+    python TncDiscovery.py
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import glob
+import os
+import sys
+import threading
+from concurrent import futures
+
+import serial
+from serial.tools import list_ports
+
+from TncModel import HeadlessApp, TncModel, call_now, clock
+
+TIMEOUT = 2.0
+
+
+def candidate_ports():
+    """Return a list of (device, usb identity) for every serial port.  The
+    identity is None for ports that are not USB devices."""
+    ports = []
+    for port in list_ports.comports():
+        if port.vid is not None:
+            usb = (port.vid, port.pid, port.serial_number, port.location)
+        else:
+            usb = None
+        ports.append((port.device, usb))
+    if os.name == 'posix':
+        known = set(device for device, usb in ports)
+        ports += [(d, None) for d in sorted(glob.glob('/dev/rfcomm*'))
+            if d not in known]
+    return ports
+
+
+def probe(device, timeout=TIMEOUT):
+    """Connect to device and return a dict describing the TNC on it, or
+    None if the port opened and stayed silent for timeout seconds.  Raises
+    the error if the port could not be opened (e.g. it is busy) and
+    IOError if something answered, but too late or not in KISS frames."""
+    start = clock()
+    app = HeadlessApp()
+    tnc = TncModel(app, device)
+    tnc.idle_add = call_now
+    tnc.stream_on_connect = False
+    tnc.CONNECT_TIMEOUT = timeout
+    try:
+        tnc.connect()
+        if tnc.time_to_ready is None:
+            if not tnc.connected() or isinstance(app.error, serial.SerialException):
+                app.check()
+            if tnc.rx_byte_count:
+                raise IOError("%s did not answer within %.1fs" % (device, timeout))
+            return None
+        tnc.wait_quiet(.05, max(0, start + timeout - clock()))
+        state = tnc.state
+        return dict(
+            device = device,
+            firmware_version = state.firmware_version,
+            hardware_version = state.hardware_version,
+            serial_number = state.serial_number,
+            mac_address = state.mac_address,
+            api_version = state.api_version,
+            elapsed = clock() - start)
+    finally:
+        tnc.disconnect()
+
+
+class TncDiscovery(object):
+    """Finds TNCs and remembers which ports have (and do not have) one."""
+
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.cache = {}     # (device, usb identity) -> probe() result
+
+    def discover(self, ports=None, refresh=False):
+        """Return a list of probe() results for the ports with a TNC, in
+        port order.  ports is a list of (device, usb identity), by default
+        candidate_ports().  Ports that are in the cache are not probed
+        again unless refresh is True.  All other ports are probed at once.
+        A port is only cached as having no TNC if it opened and stayed
+        silent, and only if it has a USB identity that would change with
+        the device plugged in.  Ports that failed, answered late or were
+        still being probed after timeout seconds are left out and probed
+        again next time."""
+        if ports is None:
+            ports = candidate_ports()
+        ports = list(ports)
+
+        with self.lock:
+            if refresh:
+                self.cache.clear()
+            else:
+                # Forget the ports that have gone away.
+                for key in set(self.cache) - set(ports):
+                    del self.cache[key]
+            pending = dict((key, futures.Future()) for key in ports
+                if key not in self.cache)
+
+        def run(device, future):
+            try:
+                future.set_result(probe(device, self.timeout))
+            except Exception as e:
+                future.set_exception(e)
+
+        # Daemon threads, so that a port that hangs on open (e.g. an
+        # unreachable Bluetooth device) does not hold up the caller.
+        for (device, usb), future in pending.items():
+            thread = threading.Thread(target=run, args=(device, future))
+            thread.daemon = True
+            thread.start()
+        futures.wait(pending.values(), self.timeout + 1.0)
+
+        with self.lock:
+            for key, future in pending.items():
+                if not future.done() or future.exception() is not None:
+                    continue
+                result = future.result()
+                if result is not None or key[1] is not None:
+                    self.cache[key] = result
+            return [self.cache[key] for key in ports
+                if self.cache.get(key) is not None]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="List the serial ports with a Mobilinkd TNC attached.")
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+        help="seconds to wait for each port (default: %.1f)" % TIMEOUT)
+    args = parser.parse_args(argv)
+
+    tncs = TncDiscovery(args.timeout).discover()
+    for tnc in tncs:
+        print("%s: firmware %s, hardware %s, serial number %s, MAC %s" % (
+            tnc['device'], tnc['firmware_version'], tnc['hardware_version'],
+            tnc['serial_number'], tnc['mac_address']))
+    if not tncs:
+        print("No TNCs found", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""
+Upload firmware to many Mobilinkd TNC1/TNC2 units at once.
+
+The Intel hex image is parsed once and the resulting Firmware is shared by
+all of the BootLoader instances.  Each port is flashed and verified in its
+own thread.  Devices are grouped by the USB hub they are attached to and
+at most --per-hub devices on one hub are flashed at a time.
+
+    python TncFlasher.py firmware.hex /dev/ttyUSB*
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import sys
+import threading
+import traceback
+from concurrent import futures
+
+import serial
+from serial.tools import list_ports
+
+from BootLoader import BootLoader, Firmware
+from TncModel import clock
+
+BAUD_RATE = 38400
+PER_HUB = 4
+MAX_WORKERS = 64
+
+
+def usb_hubs(devices):
+    """Return a dict mapping each of devices to the USB hub it is attached
+    to, e.g. '1-1' for a device at location '1-1.3:1.0', or None where
+    this is not known."""
+    locations = dict((p.device, p.location) for p in list_ports.comports())
+    hubs = {}
+    for device in devices:
+        location = locations.get(device)
+        if not location:
+            hubs[device] = None
+            continue
+        port = location.split(':')[0]
+        hubs[device] = port.rsplit('.', 1)[0] if '.' in port else port.split('-')[0]
+    return hubs
+
+
+class FlashProgress(object):
+    """The gui object given to the BootLoader for one device.  Keeps the
+    current phase and the number of blocks done, and passes changes of
+    phase to report(device, phase)."""
+
+    def __init__(self, device, report=None):
+        self.device = device
+        self.report = report
+        self.phase = 'waiting'
+        self.steps = 0
+        self.done = 0
+
+    def set_phase(self, phase):
+        self.phase = phase
+        if self.report is not None:
+            self.report(self.device, phase)
+
+    def firmware_set_steps(self, steps):
+        # Written and then read back.
+        self.steps = int(steps) * 2
+
+    def firmware_writing(self):
+        self.set_phase('writing')
+
+    def firmware_verifying(self):
+        self.set_phase('verifying')
+
+    def firmware_pulse(self):
+        self.done += 1
+
+
+def flash_device(device, firmware, progress, baud_rate=BAUD_RATE):
+    """Upload firmware, a Firmware object, to the TNC on device and verify
+    it.  Raises an exception if it fails."""
+    ser = serial.Serial(device, baud_rate, timeout=.1)
+    try:
+        progress.set_phase('connecting')
+        bootloader = BootLoader(ser, ser, firmware, progress)
+        # load() and verify() report their own errors; a failed verify
+        # leaves the flash erased.
+        bootloader.load()
+        verified = bootloader.verify()
+        bootloader.exit()
+        if not verified:
+            raise IOError("Firmware verification failed.")
+    finally:
+        ser.close()
+
+
+def flash_devices(devices, firmware, per_hub=PER_HUB, report=None,
+        baud_rate=BAUD_RATE, max_workers=None):
+    """Flash firmware (a Firmware object or file name) to each of devices,
+    with at most per_hub devices on any one USB hub in progress at once.
+    Devices whose hub is not known are counted as being on one hub.
+    report(device, phase) is called from the worker threads as each device
+    moves through 'waiting', 'connecting', 'writing', 'verifying', 'pass'
+    and 'fail'.  Returns a list of result dicts, one per device, with
+    'device', 'hub', 'success', 'error' and 'elapsed'."""
+    if not isinstance(firmware, Firmware):
+        firmware = Firmware(firmware)
+    devices = list(devices)
+    if not devices:
+        return []
+    hubs = usb_hubs(devices)
+    semaphores = dict((hub, threading.Semaphore(per_hub))
+        for hub in set(hubs.values()))
+    if max_workers is None:
+        max_workers = min(len(devices), MAX_WORKERS)
+
+    def run(device):
+        progress = FlashProgress(device, report)
+        progress.set_phase('waiting')
+        result = dict(device = device, hub = hubs[device], success = False,
+            error = None)
+        with semaphores[hubs[device]]:
+            start = clock()
+            try:
+                flash_device(device, firmware, progress, baud_rate)
+                result['success'] = True
+            except Exception as e:
+                traceback.print_exc()
+                result['error'] = str(e)
+            result['elapsed'] = clock() - start
+        progress.set_phase('pass' if result['success'] else 'fail')
+        return result
+
+    with futures.ThreadPoolExecutor(max(1, max_workers)) as executor:
+        return list(executor.map(run, devices))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Upload firmware to one or more Mobilinkd TNC1/TNC2 units.")
+    parser.add_argument('firmware', help="Intel hex firmware image")
+    parser.add_argument('devices', metavar='device', nargs='+',
+        help="serial port of a TNC")
+    parser.add_argument('--per-hub', type=int, default=PER_HUB,
+        help="devices to flash at once on one USB hub (default: %d)" % PER_HUB)
+    parser.add_argument('--baud', type=int, default=BAUD_RATE,
+        help="bootloader baud rate (default: %d)" % BAUD_RATE)
+    parser.add_argument('--report', metavar='FILE',
+        help="write a JSON report of the results to FILE")
+    args = parser.parse_args(argv)
+
+    try:
+        firmware = Firmware(args.firmware)
+    except Exception as e:
+        print("%s: %s" % (args.firmware, e), file=sys.stderr)
+        return 2
+
+    lock = threading.Lock()
+
+    def report(device, phase):
+        with lock:
+            print("%s: %s" % (device, phase))
+            sys.stdout.flush()
+
+    start = clock()
+    results = flash_devices(args.devices, firmware, args.per_hub, report,
+        args.baud)
+    elapsed = clock() - start
+
+    failed = [r for r in results if not r['success']]
+    for result in results:
+        if result['success']:
+            print("PASS %s (%.1fs)" % (result['device'], result['elapsed']))
+        else:
+            print("FAIL %s: %s" % (result['device'], result['error']))
+    print("%d of %d TNCs flashed in %.1fs" %
+        (len(results) - len(failed), len(results), elapsed))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(dict(devices = len(results),
+                passed = len(results) - len(failed), elapsed = elapsed,
+                results = results), f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
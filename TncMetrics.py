@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""
+Export TncModel link metrics.
+
+TncModel.metrics() returns a snapshot of the counters kept for each
+connection.  This module turns snapshots into Prometheus text, serves them
+over HTTP for a Prometheus scraper, or writes them as one JSON line per
+interval to a log.
+
+    server = MetricsServer([tnc], port=9469)
+    server.start()
+
+    logger = MetricsLogger([tnc], interval=60)
+    logger.start()
+"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+PORT = 9469
+
+COUNTERS = (
+    ('bytes_in', 'tnc_received_bytes_total', "Bytes read from the TNC."),
+    ('bytes_out', 'tnc_sent_bytes_total', "Bytes written to the TNC."),
+    ('junk_bytes', 'tnc_junk_bytes_total',
+        "Bytes discarded while waiting for a frame to start."),
+    ('escape_errors', 'tnc_escape_errors_total', "Invalid KISS escape sequences."),
+    ('oversize_frames', 'tnc_oversize_frames_total',
+        "Frames dropped for being longer than the decoder's limit."),
+    ('resyncs', 'tnc_resyncs_total',
+        "Partial frames abandoned to resynchronise on the next FEND."),
+)
+
+GAUGES = (
+    ('time_to_ready', 'tnc_time_to_ready_seconds',
+        "Time from opening the port to the TNC's settings being known."),
+)
+
+HISTOGRAMS = (
+    ('receive_latency', 'tnc_receive_latency_seconds',
+        "Time from receiving a packet to the main loop handling it."),
+    ('queue_depth', 'tnc_queue_depth',
+        "Packets waiting for the main loop when it drains the queue."),
+)
+
+
+def label(value):
+    return '"%s"' % str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text(snapshots):
+    """Return the snapshots from TncModel.metrics() in the Prometheus text
+    exposition format, labelled by device."""
+    lines = []
+    for key, name, text in COUNTERS:
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s counter' % name)
+        for snapshot in snapshots:
+            lines.append('%s{device=%s} %d' % (name, label(snapshot['device']),
+                snapshot[key]))
+
+    for key, name, text in GAUGES:
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s gauge' % name)
+        for snapshot in snapshots:
+            if snapshot.get(key) is not None:
+                lines.append('%s{device=%s} %s' % (name,
+                    label(snapshot['device']), repr(float(snapshot[key]))))
+
+    lines.append('# HELP tnc_frames_total Frames received by KISS type and sub-type.')
+    lines.append('# TYPE tnc_frames_total counter')
+    for snapshot in snapshots:
+        device = label(snapshot['device'])
+        for (packet_type, sub_type), count in sorted(snapshot['frames'].items(),
+                key=lambda item: (item[0][0], item[0][1] or 0)):
+            lines.append('tnc_frames_total{device=%s,type="%d",sub_type="%s"} %d' % (
+                device, packet_type, '' if sub_type is None else sub_type, count))
+
+    for key, name, text in HISTOGRAMS:
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s histogram' % name)
+        for snapshot in snapshots:
+            device = label(snapshot['device'])
+            histogram = snapshot[key]
+            for bound, count in histogram['buckets']:
+                lines.append('%s_bucket{device=%s,le="%s"} %d' % (
+                    name, device, repr(float(bound)), count))
+            lines.append('%s_bucket{device=%s,le="+Inf"} %d' % (
+                name, device, histogram['count']))
+            lines.append('%s_sum{device=%s} %s' % (
+                name, device, repr(float(histogram['sum']))))
+            lines.append('%s_count{device=%s} %d' % (
+                name, device, histogram['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def json_line(snapshot):
+    """Return a snapshot from TncModel.metrics() as one line of JSON."""
+    record = dict(snapshot)
+    record['time'] = time.time()
+    record['frames'] = dict(
+        ('%d' % t if s is None else '%d:%d' % (t, s), count)
+        for (t, s), count in snapshot['frames'].items())
+    return json.dumps(record, sort_keys=True)
+
+
+class MetricsServer(object):
+    """Serves prometheus_text() for models (a list of TncModel, which may
+    be changed while running) at any path on port."""
+
+    def __init__(self, models, port=PORT, address=''):
+        self.models = models
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = prometheus_text(
+                    [m.metrics() for m in list(owner.models)]).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer((address, port), Handler)
+        self.thd = None
+
+    def start(self):
+        self.thd = threading.Thread(target=self.server.serve_forever)
+        self.thd.daemon = True
+        self.thd.start()
+
+    def stop(self):
+        if self.thd is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.thd.join()
+        self.thd = None
+
+
+class MetricsLogger(object):
+    """Writes json_line() for each of models to out (by default stderr)
+    every interval seconds."""
+
+    def __init__(self, models, interval=60.0, out=None):
+        self.models = models
+        self.interval = interval
+        self.out = out
+        self.stopped = threading.Event()
+        self.thd = None
+
+    def start(self):
+        self.thd = threading.Thread(target=self.run)
+        self.thd.daemon = True
+        self.thd.start()
+
+    def stop(self):
+        if self.thd is None:
+            return
+        self.stopped.set()
+        self.thd.join()
+        self.thd = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            out = self.out if self.out is not None else sys.stderr
+            for model in list(self.models):
+                out.write(json_line(model.metrics()) + '\n')
+            out.flush()
@@ -1,19 +1,31 @@
 #!/bin/env python2.7
 
 from __future__ import print_function, unicode_literals
-from builtins import bytes, chr
+from builtins import bytes
 
+import os
+import select
 import threading
 import serial
 import time
 import datetime
 import math
+import heapq
+import bisect
 import traceback
-from io import StringIO, BytesIO
+import numbers
+from io import StringIO
 from struct import pack, unpack
-from gi.repository import GLib
+try:
+    from gi.repository import GLib
+except ImportError:
+    # Headless use without PyGObject; see TncModel.idle_add.
+    GLib = None
 from BootLoader import BootLoader
+from SessionRecorder import SessionRecorder
 import binascii
+from collections import OrderedDict, defaultdict, deque
+from concurrent import futures
 
 class UTC(datetime.tzinfo):
     """UTC"""
@@ -31,13 +43,79 @@ class UTC(datetime.tzinfo):
 
 utc = UTC()
 
+clock = getattr(time, 'monotonic', time.time)
+
+def call_now(function, *args):
+    """Stand-in for GLib.idle_add() when there is no main loop.  Calls the
+    function immediately, on the calling (reader) thread."""
+    function(*args)
+
+class HeadlessApp(object):
+    """The app object given to a TncModel when there is no GUI (scripts,
+    replays, the asyncio client).  For each tnc_* callback the calls are
+    counted in counts and the last value is kept in values (True for a
+    callback without arguments), both keyed by the name without 'tnc_'.
+    Callbacks and exceptions are also passed on to forward, where it has
+    them.  The first exception is kept in error until check() is called;
+    all of them are listed in exceptions."""
+
+    def __init__(self, forward=None):
+        self.forward = forward
+        self.counts = defaultdict(int)
+        self.values = {}
+        self.error = None
+        self.exceptions = []
+
+    def __getattr__(self, name):
+        if not name.startswith('tnc_'):
+            raise AttributeError(name)
+        key = name[4:]
+
+        def callback(*args):
+            self.counts[key] += 1
+            if len(args) == 1:
+                self.values[key] = args[0]
+            elif not args:
+                self.values[key] = True
+            forward = getattr(self.forward, name, None)
+            if forward is not None:
+                forward(*args)
+
+        return callback
+
+    def exception(self, e):
+        self.exceptions.append(e)
+        if self.error is None:
+            self.error = e
+        forward = getattr(self.forward, 'exception', None)
+        if forward is not None:
+            forward(e)
+
+    def check(self):
+        """Raise the first exception reported by the TncModel, if any."""
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+# Python 2 indexes a memoryview as 1-character strings, so there packets
+# get bytearray payloads (copies) instead of views into the receive buffer.
+PAYLOAD_VIEWS = isinstance(memoryview(b'\0')[0], int)
+
 class KissData(object):
 
-    def __init__(self):
-        self.packet_type = None;
-        self.sub_type = None;
-        self.data = None
-        self.ready = False;
+    __slots__ = ('packet_type', 'sub_type', 'data', 'ready')
+
+    def __init__(self, packet_type=None, sub_type=None, data=None, ready=False):
+        self.packet_type = packet_type
+        self.sub_type = sub_type
+        self.data = data
+        self.ready = ready
+    
+    def copy(self):
+        """Return this packet with its own copy of data, which may be a
+        view into a receive buffer that will be reused."""
+        return KissData(self.packet_type, self.sub_type,
+            bytearray(self.data), self.ready)
     
 
 class KissDecode(object):
@@ -52,7 +130,18 @@ class KissDecode(object):
     TFEND = 0xDC
     TFESC = 0xDD
 
-    def __init__(self):
+    FEND_BYTE = bytes(b'\xC0')
+    FESC_BYTE = bytes(b'\xDB')
+
+    # Longest frame accepted, counted as received (escaped).  A frame that
+    # grows beyond this is dropped and the decoder skips to the next FEND.
+    MAX_FRAME = 2048
+    # Number of discarded bytes kept in tmp, for debugging.
+    MAX_JUNK = 256
+
+    def __init__(self, max_frame=MAX_FRAME, max_junk=MAX_JUNK):
+        self.max_frame = max_frame
+        self.max_junk = max_junk
         self.state = self.WAIT_FEND
         self.packet = KissData()
         self.escape = False
@@ -62,6 +151,139 @@ class KissDecode(object):
             self.WAIT_SUB_TYPE: self.wait_sub_type,
             self.WAIT_DATA: self.wait_data}
         self.tmp = bytearray()
+        self.frame = bytearray()
+        self.junk_count = 0         # bytes discarded while waiting for FEND
+        self.escape_errors = 0      # bogus FESC sequences
+        self.oversize_count = 0     # frames longer than max_frame
+        self.resync_count = 0       # partial frames abandoned for a FEND
+    
+    def feed(self, data, start=0, end=None):
+        """Decode data[start:end] and return a list of all of the frames
+        completed by it.  A partial frame at the end of the block is copied
+        and completed by subsequent calls.
+
+        data is bytes or a bytearray (a memoryview is copied first).  The
+        payload of each frame is a memoryview into data, or into a copy of
+        the frame if it contained escapes or spanned calls (a bytearray
+        copy on Python 2; see PAYLOAD_VIEWS).  A caller that
+        reuses data must not do so while the packets may still be in use,
+        and a handler that keeps a payload must copy it.
+
+        This is a block-oriented alternative to process().  The two keep
+        separate partial-frame state and should not be mixed on one decoder.
+        """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if not PAYLOAD_VIEWS and not isinstance(data, bytearray):
+            # A Python 2 str indexes as characters.
+            data = bytearray(data)
+        if end is None:
+            end = len(data)
+        packets = []
+        view = memoryview(data)
+        fend = self.FEND_BYTE
+        pos = start
+        
+        if self.state == self.WAIT_FEND:
+            i = data.find(fend, pos, end)
+            if i == -1:
+                self.discard(view, pos, end)
+                return packets
+            self.discard(view, pos, i)
+            self.tmp = bytearray()
+            self.frame = bytearray()
+            pos = i + 1
+            self.state = self.WAIT_DATA
+        
+        while True:
+            i = data.find(fend, pos, end)
+            if i == -1:
+                break
+            if self.frame:
+                # Hand the completed partial frame over to the packet.
+                frame = self.frame
+                frame += view[pos:i]
+                self.frame = bytearray()
+                self.decode_frame(frame, memoryview(frame), 0, len(frame),
+                    packets)
+            else:
+                self.decode_frame(data, view, pos, i, packets)
+            pos = i + 1
+        
+        if pos < end:
+            self.frame += view[pos:end]
+            if len(self.frame) > self.max_frame:
+                # No FEND in sight; drop it and scan for the next one.
+                self.oversize_count += 1
+                self.resync_count += 1
+                self.frame = bytearray()
+                self.state = self.WAIT_FEND
+        
+        return packets
+    
+    def decode_frame(self, data, view, start, stop, packets):
+        """Append the frame in data[start:stop] (without FENDs) to packets.
+        view is memoryview(data)."""
+        if stop - start > self.max_frame:
+            self.oversize_count += 1
+            return
+        if data.find(self.FESC_BYTE, start, stop) != -1:
+            data = self.unescape(data[start:stop])
+            view = memoryview(data)
+            start, stop = 0, len(data)
+        if stop - start < 2:
+            # Duplicate FEND or truncated frame.
+            return
+        packet_type = data[start]
+        if packet_type == 0x06:
+            sub_type = data[start + 1]
+            payload = view[start + 2:stop]
+        else:
+            sub_type = None
+            payload = view[start + 1:stop]
+        if not PAYLOAD_VIEWS:
+            payload = bytearray(payload)
+        packets.append(KissData(packet_type, sub_type, payload, True))
+    
+    def discard(self, data, start, end):
+        """Count data[start:end] as junk, keeping only the last max_junk
+        bytes discarded in tmp."""
+        count = end - start
+        self.junk_count += count
+        keep = self.max_junk
+        if count >= keep:
+            self.tmp = bytearray(data[end - keep:end])
+        else:
+            self.tmp += data[start:end]
+            if len(self.tmp) > keep:
+                del self.tmp[:len(self.tmp) - keep]
+    
+    def unescape(self, frame):
+        """Replace FESC TFEND and FESC TFESC sequences in a complete frame.
+        A bogus escape sequence drops the byte following the FESC, as
+        process() does."""
+        parts = frame.split(self.FESC_BYTE)
+        result = bytearray(parts[0])
+        i = 1
+        while i < len(parts):
+            part = parts[i]
+            i += 1
+            if not part:
+                # FESC FESC -- the second FESC is the bogus escaped byte.
+                self.escape_errors += 1
+                if i < len(parts):
+                    result += parts[i]
+                    i += 1
+                continue
+            c = part[0]
+            if c == self.TFEND:
+                result.append(self.FEND)
+            elif c == self.TFESC:
+                result.append(self.FESC)
+            else:
+                self.escape_errors += 1
+            result += part[1:]
+        return result
     
     def process(self, c):
         if self.escape:
@@ -71,6 +293,7 @@ class KissDecode(object):
                 c = self.FESC
             else:
                 # Bogus sequence
+                self.escape_errors += 1
                 self.escape = False
                 return None
         elif c == self.FESC:
@@ -93,6 +316,9 @@ class KissDecode(object):
             self.tmp = bytearray()
         else:
             self.tmp.append(c)
+            self.junk_count += 1
+            if len(self.tmp) > self.max_junk:
+                del self.tmp[0]
     
     def wait_packet_type(self, c, escape):
         
@@ -113,6 +339,10 @@ class KissDecode(object):
         if not escape and c == self.FEND:
             self.packet.ready = True
             self.state = self.WAIT_FEND
+        elif len(self.packet.data) >= self.max_frame:
+            self.oversize_count += 1
+            self.resync_count += 1
+            self.state = self.WAIT_FEND
         else:
             self.packet.data.append(c)
 
@@ -123,30 +353,416 @@ class KissEncode(object):
     TFEND = bytes(b'\xDC')
     TFESC = bytes(b'\xDD')
 
-    def __init__(self):
-        pass
-    
-    def encode(self, data):
-        
-        buf = BytesIO()
-        
-        buf.write(self.FEND)
-        
-        for c in [x for x in data]:
-            if c == self.FEND:
-                buf.write(self.FESC)
-                buf.write(self.TFEND)
-            elif c == self.FESC:
-                buf.write(bytes([c]))
-                buf.write(self.TFESC)
-            else:
-                buf.write(bytes([c]))
+    # Frames for fixed commands, shared by all encoders.  See preload().
+    frames = {}
+
+    CACHE_SIZE = 256
 
-        buf.write(self.FEND)
+    def __init__(self, cache_size=CACHE_SIZE):
+        # The GUI thread and script threads (see TncModel.request()) share
+        # one encoder, so the cache is guarded by a lock.
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+    
+    @classmethod
+    def preload(cls, commands):
+        """Encode each of the given fixed commands once, for all encoders."""
+        encoder = cls()
+        for command in commands:
+            cls.frames[bytes(command)] = encoder.encode(command)
+    
+    def encode_cached(self, data):
+        """Return the encoded frame for data, using the preloaded frames or
+        an LRU cache of recently encoded (parameterised) commands."""
+        data = bytes(data)
+        frame = self.frames.get(data)
+        if frame is not None:
+            return frame
+        
+        with self.cache_lock:
+            frame = self.cache.pop(data, None)
+            if frame is not None:
+                self.cache[data] = frame
+                return frame
         
-        return buf.getvalue()
+        frame = self.encode(data)
+        with self.cache_lock:
+            self.cache.pop(data, None)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+            self.cache[data] = frame
+        return frame
+    
+    def encode_into(self, data, buf):
+        """Append the KISS frame for data to the bytearray buf.  FESC must
+        be escaped before FEND so that the inserted FESC bytes are not
+        escaped a second time."""
+        data = bytes(data)
+        if self.FESC in data:
+            data = data.replace(self.FESC, self.FESC + self.TFESC)
+        if self.FEND in data:
+            data = data.replace(self.FEND, self.FESC + self.TFEND)
+        buf += self.FEND
+        buf += data
+        buf += self.FEND
+        return buf
+    
+    def encode(self, data):
+        # A new buffer each time; encoders are shared between threads.
+        return bytes(self.encode_into(data, bytearray()))
     
 
+class TncState(object):
+    """Mirror of the settings and readings reported by a TNC.  Each field
+    has a fixed type that values are converted to; fields that have not
+    been reported are None.  version increases whenever a field changes,
+    so a saved version tells whether anything changed since."""
+
+    # Settings that can be changed with TncModel.apply(), in the order
+    # that they are sent.
+    SETTINGS = OrderedDict([
+        ('modem_type', int),
+        ('tx_delay', int),
+        ('persistence', int),
+        ('slot_time', int),
+        ('tx_tail', int),
+        ('duplex', bool),
+        ('tx_volume', int),
+        ('tx_twist', int),
+        ('input_atten', bool),
+        ('input_gain', int),
+        ('input_twist', int),
+        ('squelch_level', int),
+        ('verbosity', bool),
+        ('conn_track', bool),
+        ('ptt_channel', int),
+        ('usb_power_on', bool),
+        ('usb_power_off', bool),
+        ('passall', bool),
+        ('rx_reverse_polarity', bool),
+        ('tx_reverse_polarity', bool),
+    ])
+
+    READINGS = OrderedDict([
+        ('input_level', float),
+        ('battery_level', int),
+        ('firmware_version', str),
+        ('hardware_version', str),
+        ('serial_number', str),
+        ('mac_address', str),
+        ('date_time', str),
+        ('api_version', int),
+        ('capabilities', int),
+        ('min_input_twist', int),
+        ('max_input_twist', int),
+        ('min_input_gain', int),
+        ('max_input_gain', int),
+        ('supported_modem_types', tuple),
+    ])
+
+    FIELDS = OrderedDict(list(SETTINGS.items()) + list(READINGS.items()))
+
+    # Inclusive limits of the int settings, as the set_* commands can send
+    # them.  The rest are sent as a single unsigned byte.
+    RANGES = {
+        'tx_volume': (0, 255),
+        'tx_twist': (0, 100),
+        'input_gain': (-32768, 32767),
+        'input_twist': (-128, 127),
+    }
+
+    def __init__(self, values=None):
+        self.values = OrderedDict((name, None) for name in self.FIELDS)
+        self.version = 0
+        if values is not None:
+            for name, value in values.items():
+                self.set(name, value)
+
+    def __getattr__(self, name):
+        values = self.__dict__.get('values')
+        if values is None or name not in values:
+            raise AttributeError(name)
+        return values[name]
+
+    def set(self, name, value):
+        if name not in self.FIELDS:
+            raise ValueError("unknown TNC setting: %s" % name)
+        if value is not None:
+            value = self.FIELDS[name](value)
+        if self.values[name] != value:
+            self.values[name] = value
+            self.version += 1
+
+    def get(self, name):
+        return self.values[name]
+
+    @classmethod
+    def check(cls, name, value):
+        """Return value as the type of the setting name.  Raises ValueError
+        unless it is a bool (or 0 or 1) for a flag, or an integer within
+        RANGES for the others."""
+        kind = cls.SETTINGS.get(name)
+        if kind is None:
+            raise ValueError("not a TNC setting: %s" % name)
+        if not isinstance(value, numbers.Integral):
+            raise ValueError("%s must be %s, not %r" % (name,
+                "true or false" if kind is bool else "an integer", value))
+        if kind is bool:
+            if value not in (0, 1):
+                raise ValueError("%s must be true or false, not %r" % (name, value))
+            return bool(value)
+        if isinstance(value, bool):
+            raise ValueError("%s must be an integer, not %r" % (name, value))
+        low, high = cls.RANGES.get(name, (0, 255))
+        if not low <= value <= high:
+            raise ValueError("%s must be from %d to %d, not %d" % (
+                name, low, high, value))
+        return int(value)
+
+    def diff(self, desired):
+        """Return an OrderedDict of the settings in desired (a dict or
+        TncState) that differ from this state, converted to their types.
+        Settings this state has no value for (the TNC did not report them)
+        are left out; see unreported()."""
+        if isinstance(desired, TncState):
+            desired = desired.values
+        for name in desired:
+            if name not in self.SETTINGS:
+                raise ValueError("not a TNC setting: %s" % name)
+        changes = OrderedDict()
+        for name, kind in self.SETTINGS.items():
+            value = desired.get(name)
+            if value is None or self.values[name] is None:
+                continue
+            value = kind(value)
+            if self.values[name] != value:
+                changes[name] = value
+        return changes
+
+    def unreported(self, desired):
+        """Return the names of the settings in desired (a dict or
+        TncState) that diff() leaves out because this state has no value
+        for them."""
+        if isinstance(desired, TncState):
+            desired = desired.values
+        return [name for name in self.SETTINGS
+            if desired.get(name) is not None and self.values[name] is None]
+
+    def as_dict(self):
+        return OrderedDict(self.values)
+
+    def copy(self):
+        state = TncState(self.values)
+        state.version = self.version
+        return state
+
+
+class Histogram(object):
+    """Counts observations into fixed buckets, as a Prometheus histogram
+    does.  bounds are the inclusive upper bounds of the buckets; larger
+    values are only counted in the total."""
+
+    LATENCY_BOUNDS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025,
+        .05, .1, .25, .5, 1.0)
+    DEPTH_BOUNDS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.size = len(self.bounds)
+        self.buckets = [0] * self.size
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        if i < self.size:
+            self.buckets[i] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        """Return a dict with the cumulative bucket counts, keyed by upper
+        bound, and the count, sum and maximum of the observations."""
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds, self.buckets):
+            total += count
+            buckets.append((bound, total))
+        return {'buckets': buckets, 'count': self.count, 'sum': self.sum,
+            'max': self.max}
+
+
+class CommandWriter(object):
+    """Writes encoded frames to the TNC from a dedicated thread, so that a
+    slow port never blocks the caller.  Everything queued since the last
+    write goes out in one write() and one flush().
+
+    A frame queued with a key (normally the command template) replaces a
+    queued frame with the same key, so only the newest value of a setting
+    is sent.  Frames queued without a key are never replaced and nothing
+    queued before them is replaced afterwards, which keeps PTT and save
+    commands in order with the settings around them.
+
+    intervals maps keys to the minimum number of seconds between writes of
+    that setting.  A frame sent sooner is held and written once the
+    interval has passed, unless a newer one replaces it first, so the last
+    value is always sent.  Held frames are released early when a frame
+    without a key is queued, and when the writer stops.
+
+    send() blocks while max_queue frames are waiting."""
+
+    MAX_QUEUE = 64
+
+    def __init__(self, writer, exception, max_queue=MAX_QUEUE, intervals=None,
+            recorder=None):
+        self.writer = writer
+        self.exception = exception
+        self.recorder = recorder
+        self.max_queue = max_queue
+        self.intervals = intervals if intervals is not None else {}
+        self.queue = []
+        self.index = {}
+        self.held = {}
+        self.last_write = {}
+        self.condition = threading.Condition()
+        self.running = False
+        self.thd = None
+        self.write_count = 0
+        self.frame_count = 0
+        self.byte_count = 0
+        self.collapsed_count = 0
+        self.held_count = 0
+        self.max_batch = 0
+        self.max_depth = 0
+
+    def start(self):
+        self.running = True
+        self.thd = threading.Thread(target=self.run)
+        self.thd.daemon = True
+        self.thd.start()
+
+    def stop(self):
+        """Write anything still queued and stop the thread."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thd is not None:
+            self.thd.join()
+            self.thd = None
+
+    def send(self, frame, key=None):
+        with self.condition:
+            if key is not None and key in self.index:
+                self.queue[self.index[key]][1] = frame
+                self.collapsed_count += 1
+                return
+            if key in self.intervals:
+                due = self.last_write.get(key, 0) + self.intervals[key]
+                if key in self.held or clock() < due:
+                    if key in self.held:
+                        self.collapsed_count += 1
+                    self.held[key] = frame
+                    self.held_count += 1
+                    self.condition.notify_all()
+                    return
+            if key is None:
+                self.release(self.held)
+            self.enqueue(key, frame)
+
+    def enqueue(self, key, frame):
+        # Called with the condition held.
+        while len(self.queue) >= self.max_queue and self.running:
+            self.condition.wait()
+        if key is None:
+            self.index = {}
+        else:
+            self.index[key] = len(self.queue)
+        self.queue.append([key, frame])
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.condition.notify_all()
+
+    def release(self, keys):
+        # Move the held frames for keys to the queue.  Called with the
+        # condition held.
+        for key in list(keys):
+            self.enqueue(key, self.held.pop(key))
+
+    def next_release(self):
+        """Return (keys that are due, seconds until the next is due)."""
+        now = clock()
+        due = []
+        timeout = None
+        for key in self.held:
+            delay = self.last_write.get(key, 0) + self.intervals[key] - now
+            if delay <= 0:
+                due.append(key)
+            elif timeout is None or delay < timeout:
+                timeout = delay
+        return due, timeout
+
+    def run(self):
+        buf = bytearray()
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    due, timeout = self.next_release()
+                    if due:
+                        self.release(due)
+                    else:
+                        self.condition.wait(timeout)
+                if not self.running:
+                    self.release(self.held)
+                if not self.queue:
+                    return
+                batch = self.queue
+                self.queue = []
+                self.index = {}
+                self.condition.notify_all()
+
+            del buf[:]
+            for key, frame in batch:
+                buf += frame
+            try:
+                recorder = self.recorder
+                if recorder is not None:
+                    recorder.record_tx(buf)
+                self.writer.write(buf)
+                self.writer.flush()
+            except Exception as e:
+                self.exception(e)
+
+            now = clock()
+            with self.condition:
+                for key, frame in batch:
+                    if key in self.intervals:
+                        self.last_write[key] = now
+            self.write_count += 1
+            self.frame_count += len(batch)
+            self.byte_count += len(buf)
+            self.max_batch = max(self.max_batch, len(batch))
+
+    def statistics(self):
+        """Return queue and batching counters.  frames / writes is the mean
+        batch size; 'collapsed' counts frames replaced by a newer one and
+        'held' counts frames delayed by rate limiting."""
+        with self.condition:
+            depth = len(self.queue)
+        return {
+            'depth': depth,
+            'max_depth': self.max_depth,
+            'writes': self.write_count,
+            'frames': self.frame_count,
+            'bytes': self.byte_count,
+            'max_batch': self.max_batch,
+            'collapsed': self.collapsed_count,
+            'held': self.held_count,
+        }
+
+
 class TncModel(object):
 
     SET_TX_DELAY = bytes(b'\01%c')
@@ -194,6 +810,12 @@ class TncModel(object):
     SET_RX_REVERSE_POLARITY = bytes(b'\06\x53%c')
     SET_TX_REVERSE_POLARITY = bytes(b'\06\x55%c')
     
+    # Commands without arguments; these are encoded once at import.
+    FIXED_COMMANDS = (
+        GET_BATTERY_LEVEL, GET_ALL_VALUES, POLL_VOLUME, STREAM_VOLUME,
+        ADJUST_INPUT_LEVELS, PTT_MARK, PTT_SPACE, PTT_BOTH, PTT_OFF,
+        SAVE_EEPROM_SETTINGS, GET_PTT_CHANNEL)
+    
     TONE_NONE = 0
     TONE_SPACE = 1
     TONE_MARK = 2
@@ -243,6 +865,120 @@ class TncModel(object):
     CAP_EEPROM_SAVE = 0x0200
     CAP_ADJUST_INPUT = 0x0400
     CAP_DFU_FIRMWARE = 0x0800
+    
+    PACKET_TYPE_HARDWARE = 0x06
+    PACKET_TYPE_DEBUG = 0x07
+    
+    # Handles for which only the newest value matters.  Newer packets
+    # replace older ones that the main loop has not yet handled.
+    CONFLATED_HANDLES = frozenset([
+        (PACKET_TYPE_HARDWARE, HANDLE_INPUT_LEVEL),
+        (PACKET_TYPE_HARDWARE, HANDLE_INPUT_GAIN),
+        (PACKET_TYPE_HARDWARE, HANDLE_TX_VOLUME),
+    ])
+    
+    # Maps (packet_type, sub_type) and, for the extended ranges,
+    # (packet_type, sub_type, extended_type) to handler method names.
+    # Subclasses may extend this; see also register_handler().
+    HANDLERS = {
+        (PACKET_TYPE_DEBUG, None): 'handle_debug',
+        (PACKET_TYPE_HARDWARE, HANDLE_INPUT_LEVEL): 'handle_input_level',
+        (PACKET_TYPE_HARDWARE, HANDLE_TX_VOLUME): 'handle_tx_volume',
+        (PACKET_TYPE_HARDWARE, HANDLE_TX_TWIST): 'handle_tx_twist',
+        (PACKET_TYPE_HARDWARE, HANDLE_BATTERY_LEVEL): 'handle_battery_level',
+        (PACKET_TYPE_HARDWARE, HANDLE_INPUT_ATTEN): 'handle_input_atten',
+        (PACKET_TYPE_HARDWARE, HANDLE_INPUT_TWIST): 'handle_input_twist',
+        (PACKET_TYPE_HARDWARE, HANDLE_SQUELCH_LEVEL): 'handle_squelch_level',
+        (PACKET_TYPE_HARDWARE, HANDLE_TX_DELAY): 'handle_tx_delay',
+        (PACKET_TYPE_HARDWARE, HANDLE_PERSISTENCE): 'handle_persistence',
+        (PACKET_TYPE_HARDWARE, HANDLE_SLOT_TIME): 'handle_slot_time',
+        (PACKET_TYPE_HARDWARE, HANDLE_TX_TAIL): 'handle_tx_tail',
+        (PACKET_TYPE_HARDWARE, HANDLE_DUPLEX): 'handle_duplex',
+        (PACKET_TYPE_HARDWARE, HANDLE_FIRMWARE_VERSION): 'handle_firmware_version',
+        (PACKET_TYPE_HARDWARE, HANDLE_HARDWARE_VERSION): 'handle_hardware_version',
+        (PACKET_TYPE_HARDWARE, HANDLE_SERIAL_NUMBER): 'handle_serial_number',
+        (PACKET_TYPE_HARDWARE, HANDLE_MAC_ADDRESS): 'handle_mac_address',
+        (PACKET_TYPE_HARDWARE, HANDLE_DATE_TIME): 'handle_date_time',
+        (PACKET_TYPE_HARDWARE, HANDLE_BLUETOOTH_NAME): 'handle_bluetooth_name',
+        (PACKET_TYPE_HARDWARE, HANDLE_CONNECTION_TRACKING): 'handle_bluetooth_connection_tracking',
+        (PACKET_TYPE_HARDWARE, HANDLE_VERBOSITY): 'handle_verbosity',
+        (PACKET_TYPE_HARDWARE, HANDLE_CAPABILITIES): 'handle_capabilities',
+        (PACKET_TYPE_HARDWARE, HANDLE_PTT_CHANNEL): 'handle_ptt_channel',
+        (PACKET_TYPE_HARDWARE, HANDLE_USB_POWER_ON): 'handle_usb_power_on',
+        (PACKET_TYPE_HARDWARE, HANDLE_USB_POWER_OFF): 'handle_usb_power_off',
+        (PACKET_TYPE_HARDWARE, HANDLE_API_VERSION): 'handle_api_version',
+        (PACKET_TYPE_HARDWARE, HANDLE_MIN_INPUT_TWIST): 'handle_min_input_twist',
+        (PACKET_TYPE_HARDWARE, HANDLE_MAX_INPUT_TWIST): 'handle_max_input_twist',
+        (PACKET_TYPE_HARDWARE, HANDLE_MIN_INPUT_GAIN): 'handle_min_input_gain',
+        (PACKET_TYPE_HARDWARE, HANDLE_MAX_INPUT_GAIN): 'handle_max_input_gain',
+        (PACKET_TYPE_HARDWARE, HANDLE_PASSALL): 'handle_passall',
+        (PACKET_TYPE_HARDWARE, HANDLE_RX_REVERSE_POLARITY): 'handle_rx_reverse_polarity',
+        (PACKET_TYPE_HARDWARE, HANDLE_TX_REVERSE_POLARITY): 'handle_tx_reverse_polarity',
+        (PACKET_TYPE_HARDWARE, HANDLE_EXTENDED_1): 'handle_extended_range_1',
+        (PACKET_TYPE_HARDWARE, HANDLE_EXTENDED_1, HANDLE_EXT1_SELECTED_MODEM_TYPE):
+            'handle_selected_modem_type',
+        (PACKET_TYPE_HARDWARE, HANDLE_EXTENDED_1, HANDLE_EXT1_SUPPORTED_MODEM_TYPES):
+            'handle_supported_modem_types',
+    }
+    
+    # The replies that answer each query; see request().  GET_ALL_VALUES
+    # is answered by many handles.  The capabilities are sent by all API
+    # versions and come after the API version, so they are used here.
+    QUERY_REPLIES = {
+        GET_BATTERY_LEVEL: ((PACKET_TYPE_HARDWARE, HANDLE_BATTERY_LEVEL),),
+        GET_PTT_CHANNEL: ((PACKET_TYPE_HARDWARE, HANDLE_PTT_CHANNEL),),
+        GET_ALL_VALUES: ((PACKET_TYPE_HARDWARE, HANDLE_CAPABILITIES),),
+        POLL_VOLUME: ((PACKET_TYPE_HARDWARE, HANDLE_INPUT_LEVEL),),
+    }
+    
+    # Settings driven by sliders and spin buttons are rate limited: the
+    # same setting is written at most once per interval, and the newest
+    # value is always written.  The interval depends on the transport.
+    RATE_LIMITED_COMMANDS = (
+        SET_OUTPUT_VOLUME, SET_OUTPUT_GAIN, SET_OUTPUT_TWIST,
+        SET_INPUT_GAIN, SET_INPUT_TWIST,
+        SET_TX_DELAY, SET_PERSISTENCE, SET_TIME_SLOT)
+    RATE_LIMIT_INTERVALS = {
+        'usb': .05,
+        'bluetooth': .2,
+    }
+    
+    # The method that changes each of the TncState.SETTINGS.
+    SETTERS = {
+        'modem_type': 'set_modem_type',
+        'tx_delay': 'set_tx_delay',
+        'persistence': 'set_persistence',
+        'slot_time': 'set_time_slot',
+        'tx_tail': 'set_tx_tail',
+        'duplex': 'set_duplex',
+        'tx_volume': 'set_tx_volume',
+        'tx_twist': 'set_tx_twist',
+        'input_atten': 'set_input_atten',
+        'input_gain': 'set_input_gain',
+        'input_twist': 'set_input_twist',
+        'squelch_level': 'set_squelch_level',
+        'verbosity': 'set_verbosity',
+        'conn_track': 'set_conn_track',
+        'ptt_channel': 'set_ptt_channel',
+        'usb_power_on': 'set_usb_on',
+        'usb_power_off': 'set_usb_off',
+        'passall': 'set_passall',
+        'rx_reverse_polarity': 'set_rx_reverse_polarity',
+        'tx_reverse_polarity': 'set_tx_reverse_polarity',
+    }
+    
+    REQUEST_TIMEOUT = 2.0
+    CONNECT_TIMEOUT = 5.0
+    PROBE_INTERVAL = .25
+    QUIET_INTERVAL = .1
+    
+    # Settings only used by API 2.0 (True) or by API 1.0 (False) TNCs.
+    API_2_SETTINGS = {'input_atten': False, 'input_gain': True}
+    
+    # The reader reads into one preallocated buffer, at most RX_BLOCK_SIZE
+    # bytes at a time, and packet payloads are views into it.
+    RX_BUFFER_SIZE = 64 * 1024
+    RX_BLOCK_SIZE = 4096
 
     def __init__(self, app, ser):
         self.app = app
@@ -250,11 +986,88 @@ class TncModel(object):
         self.decoder = KissDecode()
         self.encoder = KissEncode()
         self.ser = None
+        self.sio_reader = None
+        self.sio_writer = None
         self.thd = None
+        self.command_writer = None
+        self.recorder = None
+        self.rate_limit_interval = None
         self.tone = self.TONE_NONE
         self.ptt = False
         self.reading = False
+        self.wake_pipe = None
         self.api_version = 0x0100
+        self.state = TncState()
+        self.handlers = self.dispatch_table()
+        
+        # How decoded packets get to the main loop.  Use call_now to handle
+        # them on the reader thread instead (e.g. when running headless).
+        self.idle_add = GLib.idle_add if GLib is not None else call_now
+        self.stream_on_connect = True
+        
+        # Packets decoded by the reader thread, waiting for the main loop.
+        self.rx_queue = deque()
+        self.rx_latest = {}
+        self.rx_lock = threading.Lock()
+        self.rx_drain_scheduled = False
+        self.rx_handling = False
+        self.rx_packet_count = 0
+        self.rx_drain_count = 0
+        self.rx_max_batch = 0
+        self.rx_superseded_count = 0
+        
+        # Receive buffer; see read_block().
+        self.rx_buffer = bytearray(self.RX_BUFFER_SIZE)
+        self.rx_view = memoryview(self.rx_buffer)
+        self.rx_pos = 0
+        self.rx_buffer_count = 1
+        
+        # Link metrics; see metrics().
+        self.rx_byte_count = 0
+        self.tx_byte_count = 0          # written without the CommandWriter
+        self.rx_frame_counts = {}       # (packet_type, sub_type) -> count
+        self.rx_first_time = None       # arrival of the oldest queued packet
+        self.rx_latency = Histogram(Histogram.LATENCY_BOUNDS)
+        self.rx_depth = Histogram(Histogram.DEPTH_BOUNDS)
+        self.writer_byte_count = 0      # from CommandWriters already stopped
+        
+        # Outstanding requests, by reply key and by deadline.
+        self.request_timeout = self.REQUEST_TIMEOUT
+        self.request_lock = threading.Lock()
+        self.pending = {}
+        self.deadlines = []
+        
+        # Set by the reader whenever it decodes a frame.
+        self.rx_event = threading.Event()
+        self.time_to_ready = None
+    
+    @classmethod
+    def dispatch_table(cls):
+        """Return the packet dispatch table for this class, built on first
+        use from the HANDLERS of each class in the MRO and any handlers
+        registered with register_handler().  Handler names are looked up
+        on cls, so overridden handler methods are picked up."""
+        table = cls.__dict__.get('_dispatch_table')
+        if table is None:
+            table = {}
+            for klass in reversed(cls.__mro__):
+                for key, name in klass.__dict__.get('HANDLERS', {}).items():
+                    table[key] = getattr(cls, name)
+                table.update(klass.__dict__.get('_registered_handlers', {}))
+            cls._dispatch_table = table
+        return table
+    
+    @classmethod
+    def register_handler(cls, key, handler):
+        """Register handler(model, packet) for packets matching key, a
+        (packet_type, sub_type) or (packet_type, sub_type, extended_type)
+        tuple.  This is how new firmware handles are added without a
+        subclass.  It affects cls and subclasses whose table is not yet
+        built."""
+        if '_registered_handlers' not in cls.__dict__:
+            cls._registered_handlers = {}
+        cls._registered_handlers[key] = handler
+        cls.dispatch_table()[key] = handler
     
     def __del__(self):
         self.disconnect()
@@ -269,35 +1082,77 @@ class TncModel(object):
             # print("connecting to %s" % self.serial)
             self.ser = serial.Serial(self.serial, 38400, timeout=.1)
             # print("connected")
-            time.sleep(1)
             self.sio_reader = self.ser # io.BufferedReader(self.ser)
             self.sio_writer = self.ser # io.BufferedWriter(self.ser)
             self.app.tnc_connect()
 
-            self.reading = True
-            self.thd = threading.Thread(target=self.readSerial, args=(self.sio_reader,))
-            self.thd.start()
-            
-            self.sio_writer.write(self.encoder.encode(self.PTT_OFF))
-            self.sio_writer.flush()
-            time.sleep(1)
-            self.sio_writer.write(self.encoder.encode(self.GET_ALL_VALUES))
-            self.sio_writer.flush()
-            time.sleep(1)
-            self.sio_writer.write(self.encoder.encode(self.STREAM_VOLUME))
-            self.sio_writer.flush()
+            self.start_reader()
+            self.handshake()
 
         except Exception as e:
             self.app.exception(e)
 
+    def handshake(self):
+        """Bring up a newly opened connection without fixed delays.
+
+        Opening the port resets a TNC1/TNC2, so GET_ALL_VALUES is repeated
+        every PROBE_INTERVAL until the TNC sends a valid KISS frame.  The
+        settings are then complete when the capabilities reply arrives, or,
+        for older firmware that does not send one, when nothing more has
+        arrived for QUIET_INTERVAL.  The time this took is kept in
+        time_to_ready and reported by metrics().  Raises IOError if the
+        TNC does not answer within CONNECT_TIMEOUT seconds.  Audio level
+        streaming is then started unless stream_on_connect is False."""
+        start = clock()
+        deadline = start + self.CONNECT_TIMEOUT
+        self.time_to_ready = None
+        self.rx_event.clear()
+        
+        while True:
+            remaining = deadline - clock()
+            if remaining <= 0:
+                raise IOError("No response from TNC on %s" % self.serial)
+            future = self.get_all_values(remaining)
+            if self.rx_event.wait(min(self.PROBE_INTERVAL, remaining)):
+                break
+        
+        while not future.done():
+            remaining = deadline - clock()
+            if remaining <= 0:
+                break
+            self.rx_event.clear()
+            try:
+                future.result(min(self.QUIET_INTERVAL, remaining))
+            except futures.TimeoutError:
+                if not self.rx_event.is_set():
+                    # Gone quiet: older firmware does not report its
+                    # capabilities.
+                    break
+        self.time_to_ready = clock() - start
+        
+        self.set_ptt(False)
+        if self.stream_on_connect:
+            self.stream_audio_on()
+    
+    def wait_quiet(self, quiet=.1, timeout=1.0):
+        """Wait until nothing has been received for quiet seconds, e.g. for
+        the rest of the GET_ALL_VALUES replies.  Returns False if the TNC
+        is still sending after timeout seconds."""
+        deadline = clock() + timeout
+        while True:
+            self.rx_event.clear()
+            remaining = deadline - clock()
+            if remaining <= 0:
+                return False
+            if not self.rx_event.wait(min(quiet, remaining)):
+                return True
+
     def internal_reconnect(self):
         try:
             self.sio_reader = self.ser
             self.sio_writer = self.ser
 
-            self.reading = True
-            self.thd = threading.Thread(target=self.readSerial, args=(self.sio_reader,))
-            self.thd.start()
+            self.start_reader()
             return True
         except Exception as e:
             self.app.exception(e)
@@ -306,29 +1161,63 @@ class TncModel(object):
     def reconnect(self):
         if self.internal_reconnect():
             self.app.tnc_connect()
-            self.sio_writer.write(self.encoder.encode(self.PTT_OFF))
-            self.sio_writer.flush()
-            time.sleep(1)
-            self.sio_writer.write(self.encoder.encode(self.GET_ALL_VALUES))
-            self.sio_writer.flush()
-            time.sleep(1)
-            self.sio_writer.write(self.encoder.encode(self.STREAM_VOLUME))
-            self.sio_writer.flush()
+            try:
+                self.handshake()
+            except Exception as e:
+                self.app.exception(e)
+
+    def start_reader(self):
+        """Start the reader and command writer threads."""
+        # On POSIX the reader blocks in select() on the port and a pipe that
+        # internal_disconnect() writes to in order to wake it up.
+        if os.name == 'posix' and hasattr(self.sio_reader, 'fileno'):
+            self.wake_pipe = os.pipe()
+        self.reading = True
+        self.thd = threading.Thread(target=self.readSerial, args=(self.sio_reader,))
+        self.thd.start()
+        interval = self.rate_limit_interval
+        if interval is None:
+            interval = self.RATE_LIMIT_INTERVALS[self.transport()]
+        self.command_writer = CommandWriter(self.sio_writer, self.app.exception,
+            intervals=dict((c, interval) for c in self.RATE_LIMITED_COMMANDS),
+            recorder=self.recorder)
+        self.command_writer.start()
+
+    def transport(self):
+        """Return 'bluetooth' for Bluetooth serial ports, otherwise 'usb'."""
+        name = str(self.serial).lower()
+        for tag in ('rfcomm', 'bluetooth', '-spp'):
+            if tag in name:
+                return 'bluetooth'
+        return 'usb'
 
     def internal_disconnect(self):
         self.reading = False
+        if self.command_writer is not None:
+            self.command_writer.stop()
+            self.writer_byte_count += self.command_writer.byte_count
+            self.command_writer = None
         if self.thd is not None:
-            try:
-                if self.sio_writer is not None:
-                    self.sio_writer.write(self.encoder.encode(self.POLL_VOLUME))
-                    self.sio_writer.flush()
-                self.thd.join()
-                self.thd = None
-            except Exception as e:
-                self.app.exception(e)
+            if self.sio_writer is not None:
+                try:
+                    self.write(self.encoder.encode_cached(self.POLL_VOLUME))
+                except Exception as e:
+                    self.app.exception(e)
+            # The reader must be woken and gone before the pipe is closed,
+            # even if the port write failed.
+            if self.wake_pipe is not None:
+                os.write(self.wake_pipe[1], b'\0')
+            self.thd.join()
+            self.thd = None
+        if self.wake_pipe is not None:
+            os.close(self.wake_pipe[0])
+            os.close(self.wake_pipe[1])
+            self.wake_pipe = None
 
     def disconnect(self):
         self.internal_disconnect()
+        self.stop_recording()
+        self.cancel_requests()
         if self.app is not None: self.app.tnc_disconnect()
         if self.ser is not None: self.ser.close()
         self.ser = None
@@ -339,111 +1228,339 @@ class TncModel(object):
         self.app.tnc_rx_volume(value)
     
     def handle_packet(self, packet):
-        if packet.packet_type == 0x07:
-            print(packet.data)
-        elif packet.packet_type != 0x06:
-            return
-        elif packet.sub_type == self.HANDLE_INPUT_LEVEL:
-            self.handle_input_level(packet)
-        elif packet.sub_type == self.HANDLE_TX_VOLUME:
-            self.handle_tx_volume(packet)
-        elif packet.sub_type == self.HANDLE_TX_TWIST:
-            self.handle_tx_twist(packet)
-        elif packet.sub_type == self.HANDLE_BATTERY_LEVEL:
-            self.handle_battery_level(packet)
-        elif packet.sub_type == self.HANDLE_INPUT_ATTEN:
-            self.handle_input_atten(packet)
-        elif packet.sub_type == self.HANDLE_INPUT_TWIST:
-            self.handle_input_twist(packet)
-        elif packet.sub_type == self.HANDLE_SQUELCH_LEVEL:
-            self.handle_squelch_level(packet)
-        elif packet.sub_type == self.HANDLE_TX_DELAY:
-            self.handle_tx_delay(packet)
-        elif packet.sub_type == self.HANDLE_PERSISTENCE:
-            self.handle_persistence(packet)
-        elif packet.sub_type == self.HANDLE_SLOT_TIME:
-            self.handle_slot_time(packet)
-        elif packet.sub_type == self.HANDLE_TX_TAIL:
-            self.handle_tx_tail(packet)
-        elif packet.sub_type == self.HANDLE_DUPLEX:
-            self.handle_duplex(packet)
-        elif packet.sub_type == self.HANDLE_FIRMWARE_VERSION:
-            self.handle_firmware_version(packet)
-        elif packet.sub_type == self.HANDLE_HARDWARE_VERSION:
-            self.handle_hardware_version(packet)
-        elif packet.sub_type == self.HANDLE_SERIAL_NUMBER:
-            self.handle_serial_number(packet)
-        elif packet.sub_type == self.HANDLE_MAC_ADDRESS:
-            self.handle_mac_address(packet)
-        elif packet.sub_type == self.HANDLE_DATE_TIME:
-            self.handle_date_time(packet)
-        elif packet.sub_type == self.HANDLE_BLUETOOTH_NAME:
-            self.handle_bluetooth_name(packet)
-        elif packet.sub_type == self.HANDLE_CONNECTION_TRACKING:
-            self.handle_bluetooth_connection_tracking(packet)
-        elif packet.sub_type == self.HANDLE_VERBOSITY:
-            self.handle_verbosity(packet)
-        elif packet.sub_type == self.HANDLE_CAPABILITIES:
-            self.handle_capabilities(packet)
-        elif packet.sub_type == self.HANDLE_PTT_CHANNEL:
-            self.handle_ptt_channel(packet)
-        elif packet.sub_type == self.HANDLE_USB_POWER_ON:
-            self.handle_usb_power_on(packet)
-        elif packet.sub_type == self.HANDLE_USB_POWER_OFF:
-            self.handle_usb_power_off(packet)
-        elif packet.sub_type == self.HANDLE_API_VERSION:
-            self.handle_api_version(packet)
-        elif packet.sub_type == self.HANDLE_MIN_INPUT_TWIST:
-            self.handle_min_input_twist(packet)
-        elif packet.sub_type == self.HANDLE_MAX_INPUT_TWIST:
-            self.handle_max_input_twist(packet)
-        elif packet.sub_type == self.HANDLE_MIN_INPUT_GAIN:
-            self.handle_min_input_gain(packet)
-        elif packet.sub_type == self.HANDLE_MAX_INPUT_GAIN:
-            self.handle_max_input_gain(packet)
-        elif packet.sub_type == self.HANDLE_PASSALL:
-            self.handle_passall(packet)
-        elif packet.sub_type == self.HANDLE_RX_REVERSE_POLARITY:
-            self.handle_rx_reverse_polarity(packet)
-        elif packet.sub_type == self.HANDLE_TX_REVERSE_POLARITY:
-            self.handle_tx_reverse_polarity(packet)
-        elif packet.sub_type == self.HANDLE_EXTENDED_1:
-            self.handle_extended_range_1(packet)
-        else:
-            # print "handle_packet: unknown packet sub_type (%d)" % packet.sub_type
-            # print "data:", packet.data
-            pass
+        handler = self.handlers.get((packet.packet_type, packet.sub_type))
+        if handler is not None:
+            handler(self, packet)
     
     def handle_extended_range_1(self, packet):
-        extended_type = packet.data[0]
-        packet.data = packet.data[1:]
-        if extended_type == self.HANDLE_EXT1_SELECTED_MODEM_TYPE:
-            self.handle_selected_modem_type(packet)
-        elif extended_type == self.HANDLE_EXT1_SUPPORTED_MODEM_TYPES:
-            self.handle_supported_modem_types(packet)
-        else:
-            pass # Unknown extended type
+        if len(packet.data) == 0:
+            return
+        key = (packet.packet_type, packet.sub_type, packet.data[0])
+        handler = self.handlers.get(key)
+        if handler is not None:
+            # A view past the sub-key; the payload itself is not copied.
+            if PAYLOAD_VIEWS:
+                packet.data = memoryview(packet.data)[1:]
+            else:
+                packet.data = packet.data[1:]
+            handler(self, packet)
+    
+    def handle_debug(self, packet):
+        print(bytes(packet.data))
     
     def readSerial(self, sio):
+        """Reader thread.  Sleeps until data arrives, then reads everything
+        the port has buffered.  Falls back to polling with the port timeout
+        where select() cannot be used on the port (Windows)."""
+        if self.wake_pipe is None:
+            return self.pollSerial(sio)
+        
+        fds = [sio.fileno(), self.wake_pipe[0]]
         while self.reading:
             try:
-                block = bytes(sio.read(160))
-                if len(block) == 0:
-                    continue
-                for c in block:
-                    packet = self.decoder.process(c)
-                    if packet is not None:
-                        GLib.idle_add(self.handle_packet, packet)
+                readable = select.select(fds, [], [], self.next_deadline())[0]
+                if fds[1] in readable:
+                    os.read(fds[1], 64)
+                if fds[0] in readable:
+                    start, end = self.read_block(sio)
+                    self.rx_byte_count += end - start
+                    # stop_recording() may clear it from another thread.
+                    recorder = self.recorder
+                    if recorder is not None:
+                        recorder.record_rx(self.rx_view[start:end])
+                    packets = self.decoder.feed(self.rx_buffer, start, end)
+                    if packets:
+                        self.rx_event.set()
+                        self.deliver_packets(packets)
+                        self.complete_requests(packets)
+                self.expire_requests()
             except ValueError as e:
                 self.app.exception(e)
-                pass
+            except serial.SerialException as e:
+                # Device went away (e.g. Bluetooth link dropped).
+                self.app.exception(e)
+                break
         
         # print "done reading..."
     
+    def pollSerial(self, sio):
+        while self.reading:
+            try:
+                start, end = self.read_block(sio)
+                self.rx_byte_count += end - start
+                recorder = self.recorder
+                if end > start and recorder is not None:
+                    recorder.record_rx(self.rx_view[start:end])
+                packets = self.decoder.feed(self.rx_buffer, start, end)
+                if packets:
+                    self.rx_event.set()
+                    self.deliver_packets(packets)
+                    self.complete_requests(packets)
+                self.expire_requests()
+            except ValueError as e:
+                self.app.exception(e)
+                pass
+    
+    def read_block(self, sio):
+        """Read what the port has buffered (at least one byte, subject to
+        the port timeout) into the receive buffer.  Returns the start and
+        end of the bytes read in rx_buffer."""
+        size = min(sio.in_waiting or 1, self.RX_BLOCK_SIZE)
+        if self.rx_pos + size > len(self.rx_buffer):
+            self.rewind_buffer()
+        start = self.rx_pos
+        self.rx_pos = start + sio.readinto(self.rx_view[start:start + size])
+        return start, self.rx_pos
+    
+    def rewind_buffer(self):
+        """Start again at the beginning of the receive buffer.  If packets
+        pointing into it are still waiting for or being handled by the main
+        loop, they keep the old buffer and a new one is allocated."""
+        with self.rx_lock:
+            busy = self.rx_drain_scheduled or self.rx_handling
+        if busy:
+            self.rx_buffer = bytearray(self.RX_BUFFER_SIZE)
+            self.rx_view = memoryview(self.rx_buffer)
+            self.rx_buffer_count += 1
+        self.rx_pos = 0
+    
+    def send(self, data, key=None):
+        """Encode data and queue it for the TNC.  key, normally the command
+        template, lets a queued setting be replaced by a newer value; see
+        CommandWriter.  Without a writer thread the frame is written
+        directly."""
+        frame = self.encoder.encode_cached(data)
+        if self.command_writer is not None:
+            self.command_writer.send(frame, key)
+        else:
+            self.write(frame)
+    
+    def write(self, frame):
+        """Write an encoded frame straight to the port."""
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.record_tx(frame)
+        self.sio_writer.write(frame)
+        self.sio_writer.flush()
+        self.tx_byte_count += len(frame)
+    
+    def start_recording(self, filename):
+        """Append all bytes sent to and received from the TNC to the
+        session file filename (see SessionRecorder) until
+        stop_recording() or disconnect() is called."""
+        self.stop_recording()
+        self.recorder = SessionRecorder(filename)
+        if self.command_writer is not None:
+            self.command_writer.recorder = self.recorder
+    
+    def stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if self.command_writer is not None:
+            self.command_writer.recorder = None
+        if recorder is not None:
+            recorder.close()
+    
+    def writer_statistics(self):
+        if self.command_writer is None:
+            return None
+        return self.command_writer.statistics()
+    
+    def request(self, command, timeout=None):
+        """Send a query listed in QUERY_REPLIES.  Returns a
+        concurrent.futures.Future that completes with the KissData reply as
+        soon as the reader thread decodes it, before the reply is handled
+        on the main loop.  The future fails with futures.TimeoutError if
+        no reply arrives within timeout (default request_timeout) seconds.
+        """
+        future = futures.Future()
+        if self.sio_writer is None:
+            future.set_exception(IOError("TNC is not connected"))
+            return future
+        
+        replies = self.QUERY_REPLIES[command]
+        if timeout is None:
+            timeout = self.request_timeout
+        with self.request_lock:
+            for key in replies:
+                self.pending.setdefault(key, []).append(future)
+            heapq.heappush(self.deadlines,
+                (clock() + timeout, id(future), future, replies))
+        self.wake_reader()
+        
+        try:
+            self.send(command)
+        except Exception as e:
+            self.app.exception(e)
+            if not future.done():
+                future.set_exception(e)
+        return future
+    
+    def wake_reader(self):
+        # Make the reader recompute its select() timeout.
+        if self.wake_pipe is not None:
+            os.write(self.wake_pipe[1], b'\0')
+    
+    def next_deadline(self):
+        """Seconds until the earliest request deadline, or None."""
+        with self.request_lock:
+            if not self.deadlines:
+                return None
+            return max(0, self.deadlines[0][0] - clock())
+    
+    def complete_requests(self, packets):
+        if not self.pending:
+            return
+        done = []
+        with self.request_lock:
+            for packet in packets:
+                waiters = self.pending.pop(
+                    (packet.packet_type, packet.sub_type), None)
+                if waiters:
+                    done.extend((future, packet) for future in waiters)
+        for future, packet in done:
+            if not future.done():
+                # The caller may keep the packet past the buffer's reuse.
+                future.set_result(packet.copy())
+    
+    def expire_requests(self):
+        """Fail requests whose deadline has passed and forget requests
+        that completed through another reply key."""
+        if not self.deadlines:
+            return
+        now = clock()
+        expired = []
+        with self.request_lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                deadline, ident, future, replies = heapq.heappop(self.deadlines)
+                for key in replies:
+                    waiters = self.pending.get(key)
+                    if waiters is not None and future in waiters:
+                        waiters.remove(future)
+                        if not waiters:
+                            del self.pending[key]
+                expired.append(future)
+        for future in expired:
+            if not future.done():
+                future.set_exception(futures.TimeoutError(
+                    "no reply from TNC"))
+    
+    def cancel_requests(self):
+        with self.request_lock:
+            pending = [entry[2] for entry in self.deadlines]
+            self.pending = {}
+            self.deadlines = []
+        for future in pending:
+            future.cancel()
+    
+    def deliver_packets(self, packets):
+        """Queue decoded packets for the main loop.  Called from the reader
+        thread.  At most one drain_packets() idle callback is pending at any
+        time, no matter how many packets arrive.  Packets for one of the
+        CONFLATED_HANDLES replace any pending packet for the same handle."""
+        conflated = self.CONFLATED_HANDLES
+        counts = self.rx_frame_counts
+        with self.rx_lock:
+            for packet in packets:
+                key = (packet.packet_type, packet.sub_type)
+                counts[key] = counts.get(key, 0) + 1
+                if key in conflated:
+                    if key in self.rx_latest:
+                        self.rx_superseded_count += 1
+                    self.rx_latest[key] = packet
+                else:
+                    self.rx_queue.append(packet)
+            if self.rx_drain_scheduled:
+                return
+            self.rx_drain_scheduled = True
+            self.rx_first_time = clock()
+        self.idle_add(self.drain_packets)
+    
+    def drain_packets(self):
+        """Handle every packet queued so far.  Runs on the main loop.  The
+        conflated packets are handled last so that they are decoded with
+        the current api_version."""
+        with self.rx_lock:
+            self.rx_drain_scheduled = False
+            if self.rx_first_time is not None:
+                self.rx_latency.observe(clock() - self.rx_first_time)
+                self.rx_first_time = None
+            packets = list(self.rx_queue)
+            self.rx_queue.clear()
+            packets.extend(self.rx_latest.values())
+            self.rx_latest = {}
+            # Everything queued since the last drain: the deepest the queue got.
+            self.rx_depth.observe(len(packets))
+            self.rx_handling = True
+        
+        for packet in packets:
+            try:
+                self.handle_packet(packet)
+            except Exception:
+                traceback.print_exc()
+        
+        with self.rx_lock:
+            self.rx_handling = False
+        
+        count = len(packets)
+        self.rx_packet_count += count
+        self.rx_drain_count += 1
+        self.rx_max_batch = max(self.rx_max_batch, count)
+        return False
+    
+    def delivery_statistics(self):
+        """Return counters describing main-loop packet delivery.  'drains'
+        is the number of idle callbacks that were scheduled for 'packets'
+        packets; their ratio is the mean batch size.  'superseded' counts
+        the conflated packets dropped in favour of a newer value.  'buffers'
+        is the number of receive buffers allocated: another is needed only
+        when the main loop still holds packets from the current one as the
+        reader wraps around."""
+        return {
+            'packets': self.rx_packet_count,
+            'drains': self.rx_drain_count,
+            'max_batch': self.rx_max_batch,
+            'queued': len(self.rx_queue) + len(self.rx_latest),
+            'superseded': self.rx_superseded_count,
+            'buffers': self.rx_buffer_count,
+        }
+    
+    def metrics(self):
+        """Return a snapshot of the link metrics as a dict: bytes in and
+        out, frames received by (packet_type, sub_type), the decoder's
+        junk bytes, escape errors, oversize frames and resyncs, the depth
+        the main-loop queue reached before each drain and the latency from
+        a packet being received to the main loop handling it (for the
+        oldest packet of each batch), the time_to_ready of the last
+        handshake() (None before one completes), plus
+        delivery_statistics() and writer_statistics().  See TncMetrics for
+        Prometheus and JSON output."""
+        writer = self.writer_statistics()
+        with self.rx_lock:
+            frames = dict(self.rx_frame_counts)
+            latency = self.rx_latency.snapshot()
+            depth = self.rx_depth.snapshot()
+        return {
+            'device': self.serial,
+            'bytes_in': self.rx_byte_count,
+            'bytes_out': self.tx_byte_count + self.writer_byte_count
+                + (writer['bytes'] if writer is not None else 0),
+            'frames': frames,
+            'junk_bytes': self.decoder.junk_count,
+            'escape_errors': self.decoder.escape_errors,
+            'oversize_frames': self.decoder.oversize_count,
+            'resyncs': self.decoder.resync_count,
+            'time_to_ready': self.time_to_ready,
+            'queue_depth': depth,
+            'receive_latency': latency,
+            'delivery': self.delivery_statistics(),
+            'writer': writer,
+        }
+    
     def handle_input_level(self, packet):
         v = packet.data[0]
         v = max(v, 1)
         volume = math.log(v) / math.log(2)
+        self.state.set('input_level', volume)
         self.app.tnc_rx_volume(volume)
     
     def handle_tx_volume(self, packet):
@@ -451,65 +1568,86 @@ class TncModel(object):
             volume = packet.data[0]
         else:
             volume = (packet.data[0] * 256) + packet.data[1]
+        self.state.set('tx_volume', volume)
         self.app.tnc_tx_volume(volume)
     
     def handle_tx_twist(self, packet):
         twist = packet.data[0]
+        self.state.set('tx_twist', twist)
         self.app.tnc_tx_twist(twist)
     
     def handle_battery_level(self, packet):
         value = (packet.data[0] << 8) + packet.data[1]
+        self.state.set('battery_level', value)
         self.app.tnc_battery_level(value)
     
     # Also HANDLE_INPUT_GAIN
     def handle_input_atten(self, packet):
         if self.api_version == 0x0100:
             atten = packet.data[0]
+            self.state.set('input_atten', atten != 0)
             self.app.tnc_input_atten(atten != 0)
         else:
             gain = unpack('>h', packet.data)[0]
+            self.state.set('input_gain', gain)
             self.app.tnc_input_gain(gain)
     
     def handle_input_twist(self, packet):
-        twist = packet.data[0]
+        # Signed, as set_input_twist() sends it.
+        twist = unpack('b', bytes(packet.data[:1]))[0]
+        self.state.set('input_twist', twist)
         self.app.tnc_input_twist(twist)
     
     def handle_squelch_level(self, packet):
         squelch = packet.data[0]
+        self.state.set('squelch_level', squelch)
         self.app.tnc_dcd(squelch)
     
     def handle_tx_delay(self, packet):
         value = packet.data[0]
+        self.state.set('tx_delay', value)
         self.app.tnc_tx_delay(value)
     
     def handle_persistence(self, packet):
         value = packet.data[0]
+        self.state.set('persistence', value)
         self.app.tnc_persistence(value)
     
     def handle_slot_time(self, packet):
         value = packet.data[0]
+        self.state.set('slot_time', value)
         self.app.tnc_slot_time(value)
     
     def handle_tx_tail(self, packet):
         value = packet.data[0]
+        self.state.set('tx_tail', value)
         self.app.tnc_tx_tail(value)
     
     def handle_duplex(self, packet):
         value = packet.data[0]
+        self.state.set('duplex', value != 0)
         self.app.tnc_duplex(value != 0)
     
     def handle_firmware_version(self, packet):
-        self.app.tnc_firmware_version(packet.data.decode("utf-8"))
+        value = bytes(packet.data).decode("utf-8")
+        self.state.set('firmware_version', value)
+        self.app.tnc_firmware_version(value)
     
     def handle_hardware_version(self, packet):
-        self.app.tnc_hardware_version(packet.data.decode("utf-8"))
+        value = bytes(packet.data).decode("utf-8")
+        self.state.set('hardware_version', value)
+        self.app.tnc_hardware_version(value)
     
     def handle_serial_number(self, packet):
-        self.app.tnc_serial_number(packet.data.decode("utf-8"))
+        value = bytes(packet.data).decode("utf-8")
+        self.state.set('serial_number', value)
+        self.app.tnc_serial_number(value)
         return
     
     def handle_mac_address(self, packet):
-        self.app.tnc_mac_address(':'.join('{:02X}'.format(a) for a in packet.data))
+        value = ':'.join('{:02X}'.format(a) for a in packet.data)
+        self.state.set('mac_address', value)
+        self.app.tnc_mac_address(value)
         return
 
     def handle_date_time(self, packet):
@@ -528,8 +1666,10 @@ class TncModel(object):
         second = bcd_to_int(d[6])
         try:
             dt = datetime.datetime(year, month, day, hour, minute, second, tzinfo=utc)
+            self.state.set('date_time', dt.isoformat())
             self.app.tnc_date_time(dt.isoformat())
         except Exception as ex:
+            self.state.set('date_time', None)
             self.app.tnc_date_time("RTC ERROR")
             self.app.exception(ex)
     
@@ -537,24 +1677,30 @@ class TncModel(object):
         pass
     
     def handle_bluetooth_connection_tracking(self, packet):
+        self.state.set('conn_track', packet.data[0])
         self.app.tnc_conn_track(packet.data[0])
     
     def handle_verbosity(self, packet):
+        self.state.set('verbosity', packet.data[0])
         self.app.tnc_verbose(packet.data[0])
         
     def handle_ptt_channel(self, packet):
+        self.state.set('ptt_channel', packet.data[0])
         self.app.tnc_ptt_style(packet.data[0])
         
     def handle_usb_power_on(self, packet):
+        self.state.set('usb_power_on', packet.data[0])
         self.app.tnc_power_on(packet.data[0])
         
     def handle_usb_power_off(self, packet):
+        self.state.set('usb_power_off', packet.data[0])
         self.app.tnc_power_off(packet.data[0])
         
     def handle_capabilities(self, packet):
         if len(packet.data) < 2:
             return
         value = packet.data[1]
+        self.state.set('capabilities', (value << 8) | packet.data[0])
         if (value << 8) & self.CAP_EEPROM_SAVE:
             self.app.tnc_eeprom_save()
         if (value << 8) & self.CAP_ADJUST_INPUT:
@@ -567,62 +1713,105 @@ class TncModel(object):
         if len(packet.data) < 2:
             return
         self.api_version = unpack('>h', packet.data)[0]
+        self.state.set('api_version', self.api_version)
 
     def handle_min_input_twist(self, packet):
-        self.app.tnc_min_input_twist(unpack('b', packet.data)[0])
+        value = unpack('b', packet.data)[0]
+        self.state.set('min_input_twist', value)
+        self.app.tnc_min_input_twist(value)
    
     def handle_max_input_twist(self, packet):
-        self.app.tnc_max_input_twist(unpack('b', packet.data)[0])
+        value = unpack('b', packet.data)[0]
+        self.state.set('max_input_twist', value)
+        self.app.tnc_max_input_twist(value)
    
     def handle_min_input_gain(self, packet):
-        self.app.tnc_min_input_gain(unpack('>h', packet.data)[0])
+        value = unpack('>h', packet.data)[0]
+        self.state.set('min_input_gain', value)
+        self.app.tnc_min_input_gain(value)
    
     def handle_max_input_gain(self, packet):
-        self.app.tnc_max_input_gain(unpack('>h', packet.data)[0])
+        value = unpack('>h', packet.data)[0]
+        self.state.set('max_input_gain', value)
+        self.app.tnc_max_input_gain(value)
 
     def handle_passall(self, packet):
+        self.state.set('passall', packet.data[0])
         self.app.tnc_passall(packet.data[0])
 
     def handle_rx_reverse_polarity(self, packet):
+        self.state.set('rx_reverse_polarity', packet.data[0])
         self.app.tnc_rx_reverse_polarity(packet.data[0])
 
     def handle_tx_reverse_polarity(self, packet):
+        self.state.set('tx_reverse_polarity', packet.data[0])
         self.app.tnc_tx_reverse_polarity(packet.data[0])
 
     def handle_selected_modem_type(self, packet):
+        self.state.set('modem_type', packet.data[0])
         self.app.tnc_selected_modem_type(packet.data[0])
 
     def handle_supported_modem_types(self, packet):
-        self.app.tnc_supported_modem_types(packet.data)
+        value = tuple(packet.data)
+        self.state.set('supported_modem_types', value)
+        self.app.tnc_supported_modem_types(value)
 
+    def supports(self, name):
+        """Return whether the setting name is used by this TNC's API
+        version.  input_atten (API 1.0) and input_gain (later versions)
+        share a handle with different formats, so each is only sent to its
+        own version."""
+        api_2 = self.API_2_SETTINGS.get(name)
+        return api_2 is None or api_2 == (self.api_version != 0x0100)
+    
+    def unsupported(self, desired):
+        """Return the names of the settings in desired (a dict or
+        TncState) that apply() skips: those the TNC did not report and
+        those its API version does not use."""
+        if isinstance(desired, TncState):
+            desired = desired.values
+        skipped = self.state.unreported(desired)
+        return [name for name in self.state.SETTINGS
+            if desired.get(name) is not None
+                and (name in skipped or not self.supports(name))]
+    
+    def apply(self, desired):
+        """Bring the TNC's settings to desired, a dict or TncState.  Only
+        the settings whose value differs from the mirrored state are sent;
+        None values and the unsupported() settings are ignored.  Returns an
+        OrderedDict of the settings that were sent.  The state is updated
+        with the sent values."""
+        if self.sio_writer is None: return OrderedDict()
+        changes = self.state.diff(desired)
+        for name in list(changes):
+            if not self.supports(name):
+                del changes[name]
+        for name, value in changes.items():
+            getattr(self, self.SETTERS[name])(value)
+            self.state.set(name, value)
+        return changes
    
     def set_tx_volume(self, volume):
         if self.sio_writer is None: return
         try:
             if self.api_version == 0x0100:
-                self.sio_writer.write(self.encoder.encode(
-                    bytes(pack('>BBB', 6, 1, volume))))
+                self.send(bytes(pack('>BBB', 6, 1, volume)), self.SET_OUTPUT_VOLUME)
             else:
-                self.sio_writer.write(self.encoder.encode(
-                    bytes(pack('>BBh', 6, 1, volume))))
-            self.sio_writer.flush()
+                self.send(bytes(pack('>BBh', 6, 1, volume)), self.SET_OUTPUT_GAIN)
         except Exception as e:
             self.app.exception(e)
 
     def set_tx_twist(self, twist):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(
-                bytes(pack('>BBb', 6, 0x1a, twist))))
-            self.sio_writer.flush()
+            self.send(bytes(pack('>BBb', 6, 0x1a, twist)), self.SET_OUTPUT_TWIST)
         except Exception as e:
             self.app.exception(e)
 
     def set_input_atten(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_INPUT_ATTEN % (2 * value)))
-            self.sio_writer.flush()
+            self.send(self.SET_INPUT_ATTEN % (2 * value), self.SET_INPUT_ATTEN)
         except Exception as e:
             self.app.exception(e)
     
@@ -630,138 +1819,119 @@ class TncModel(object):
         """Used to set DCD"""
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_SQUELCH_LEVEL % (value)))
-            self.sio_writer.flush()
+            self.send(self.SET_SQUELCH_LEVEL % (value), self.SET_SQUELCH_LEVEL)
         except Exception as e:
             self.app.exception(e)
     
     def set_input_gain(self, gain):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(
-                bytes(pack('>BBh', 6, 0x2, gain))))
-            self.sio_writer.flush()
+            self.send(bytes(pack('>BBh', 6, 0x2, gain)), self.SET_INPUT_GAIN)
         except Exception as e:
             self.app.exception(e)
 
     def set_input_twist(self, twist):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(
-                bytes(pack('>BBb', 6, 0x18, twist))))
-            self.sio_writer.flush()
+            self.send(bytes(pack('>BBb', 6, 0x18, twist)), self.SET_INPUT_TWIST)
         except Exception as e:
             self.app.exception(e)
     
     def adjust_input(self):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.ADJUST_INPUT_LEVELS))
-            self.sio_writer.flush()
+            self.send(self.ADJUST_INPUT_LEVELS)
         except Exception as e:
             self.app.exception(e)
 
     def set_tx_delay(self, delay):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_TX_DELAY % delay))
-            self.sio_writer.flush()
+            self.send(self.SET_TX_DELAY % delay, self.SET_TX_DELAY)
         except Exception as e:
             self.app.exception(e)
 
     def set_persistence(self, p):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_PERSISTENCE % (p)))
-            self.sio_writer.flush()
+            self.send(self.SET_PERSISTENCE % (p), self.SET_PERSISTENCE)
         except Exception as e:
             self.app.exception(e)
     
     def set_time_slot(self, timeslot):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_TIME_SLOT % (timeslot)))
-            self.sio_writer.flush()
+            self.send(self.SET_TIME_SLOT % (timeslot), self.SET_TIME_SLOT)
         except Exception as e:
             self.app.exception(e)
     
     def set_tx_tail(self, tail):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_TX_TAIL % (tail)))
-            self.sio_writer.flush()
+            self.send(self.SET_TX_TAIL % (tail), self.SET_TX_TAIL)
         except Exception as e:
             self.app.exception(e)
     
     def set_duplex(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_DUPLEX % (value)))
-            self.sio_writer.flush()
+            self.send(self.SET_DUPLEX % (value), self.SET_DUPLEX)
         except Exception as e:
             self.app.exception(e)
     
     def set_conn_track(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_BT_CONN_TRACK % (value)))
-            self.sio_writer.flush()
+            self.send(self.SET_BT_CONN_TRACK % (value), self.SET_BT_CONN_TRACK)
         except Exception as e:
             self.app.exception(e)
     
     def set_verbosity(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_VERBOSITY % (value)))
-            self.sio_writer.flush()
+            self.send(self.SET_VERBOSITY % (value), self.SET_VERBOSITY)
         except Exception as e:
             self.app.exception(e)
     
     def set_passall(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_PASSALL % (value)))
-            self.sio_writer.flush()
+            self.send(self.SET_PASSALL % (value), self.SET_PASSALL)
         except Exception as e:
             self.app.exception(e)
     
     def set_rx_reverse_polarity(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_RX_REVERSE_POLARITY % (value)))
-            self.sio_writer.flush()
+            self.send(self.SET_RX_REVERSE_POLARITY % (value), self.SET_RX_REVERSE_POLARITY)
         except Exception as e:
             self.app.exception(e)
     
     def set_tx_reverse_polarity(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_TX_REVERSE_POLARITY % (value)))
-            self.sio_writer.flush()
+            self.send(self.SET_TX_REVERSE_POLARITY % (value), self.SET_TX_REVERSE_POLARITY)
         except Exception as e:
             self.app.exception(e)
     
     def set_modem_type(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_MODEM_TYPE % (value)))
-            self.sio_writer.flush()
+            self.send(self.SET_MODEM_TYPE % (value), self.SET_MODEM_TYPE)
         except Exception as e:
             self.app.exception(e)
 
     def set_usb_on(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_USB_POWER_ON % chr(value)))
-            self.sio_writer.flush()
+            self.send(self.SET_USB_POWER_ON % (value), self.SET_USB_POWER_ON)
         except Exception as e:
             self.app.exception(e)
         
     def set_usb_off(self, value):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_USB_POWER_OFF % (value)))
-            self.sio_writer.flush()
+            self.send(self.SET_USB_POWER_OFF % (value), self.SET_USB_POWER_OFF)
         except Exception as e:
             self.app.exception(e)
         
@@ -769,8 +1939,7 @@ class TncModel(object):
     def save_eeprom_settings(self):
         if self.sio_writer is None: return
         try:
-            self.sio_writer.write(self.encoder.encode(self.SAVE_EEPROM_SETTINGS))
-            self.sio_writer.flush()
+            self.send(self.SAVE_EEPROM_SETTINGS)
         except Exception as e:
             self.app.exception(e)
 
@@ -778,9 +1947,8 @@ class TncModel(object):
         if self.sio_writer is None: return
         
         try:
-            self.sio_writer.write(self.encoder.encode(self.SET_PTT_CHANNEL % int(value)))
-            self.sio_writer.write(self.encoder.encode(self.GET_PTT_CHANNEL))
-            self.sio_writer.flush()
+            self.send(self.SET_PTT_CHANNEL % int(value), self.SET_PTT_CHANNEL)
+            self.send(self.GET_PTT_CHANNEL)
         except Exception as e:
             self.app.exception(e)
     
@@ -809,29 +1977,32 @@ class TncModel(object):
         try:
             if value and self.tone != self.TONE_NONE:
                 if self.tone == self.TONE_MARK:
-                    self.sio_writer.write(self.encoder.encode(self.PTT_MARK))
+                    self.send(self.PTT_MARK)
                 elif self.tone == self.TONE_SPACE:
-                    self.sio_writer.write(self.encoder.encode(self.PTT_SPACE))
+                    self.send(self.PTT_SPACE)
                 elif self.tone == self.TONE_BOTH:
-                    self.sio_writer.write(self.encoder.encode(self.PTT_BOTH))
+                    self.send(self.PTT_BOTH)
             else:
-                self.sio_writer.write(self.encoder.encode(self.PTT_OFF))
-        
-            self.sio_writer.flush()
+                self.send(self.PTT_OFF)
         except Exception as e:
             self.app.exception(e)
     
     def stream_audio_on(self):
         if self.sio_writer is None: return
-        self.sio_writer.write(self.encoder.encode(self.STREAM_VOLUME))
+        self.send(self.STREAM_VOLUME)
     
     def stream_audio_off(self):
         if self.sio_writer is None: return
-        self.sio_writer.write(self.encoder.encode(self.POLL_VOLUME))
+        self.send(self.POLL_VOLUME)
 
-    def get_battery_level(self):
-        if self.sio_writer is None: return
-        self.sio_writer.write(self.encoder.encode(self.GET_BATTERY_LEVEL))
+    def get_battery_level(self, timeout=None):
+        return self.request(self.GET_BATTERY_LEVEL, timeout)
+
+    def get_ptt_channel(self, timeout=None):
+        return self.request(self.GET_PTT_CHANNEL, timeout)
+
+    def get_all_values(self, timeout=None):
+        return self.request(self.GET_ALL_VALUES, timeout)
 
     def upload_firmware_thd(self, filename, gui):
         try:
@@ -865,6 +2036,7 @@ class TncModel(object):
         self.firmware_thd.join()
         time.sleep(5)
         self.internal_reconnect()
-        self.sio_writer.write(self.encoder.encode(self.GET_ALL_VALUES))
+        self.send(self.GET_ALL_VALUES)
 
 
+KissEncode.preload(TncModel.FIXED_COMMANDS)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+"""
+Apply a settings profile to a Mobilinkd TNC without the GUI.
+
+A profile is a JSON (or, if PyYAML is installed, YAML) mapping of TncState
+setting names to values, for example:
+
+    {
+        "modem_type": 1,
+        "tx_delay": 30,
+        "persistence": 63,
+        "slot_time": 10,
+        "tx_volume": 128,
+        "tx_twist": 50,
+        "input_gain": 0,
+        "input_twist": 6,
+        "ptt_channel": 0,
+        "rx_reverse_polarity": false,
+        "tx_reverse_polarity": false,
+        "passall": false,
+        "usb_power_on": true,
+        "usb_power_off": true
+    }
+
+Settings that are left out, or set to null, are not changed.  The TNC is
+connected, its current settings read, only the settings that differ are
+written and, if the TNC supports it, they are saved to EEPROM.
+
+Any number of TNCs can be configured at once; each is handled in its own
+worker thread and the results can be written to a JSON report.
+
+    python TncProfile.py profile.json /dev/ttyUSB0
+    python TncProfile.py --report report.json profile.json /dev/ttyUSB*
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import sys
+from concurrent import futures
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from TncModel import HeadlessApp, TncModel, TncState, call_now, clock
+
+
+def load_profile(filename):
+    """Read a profile from filename and return it as a dict.  Files ending
+    in .yaml or .yml are read as YAML, anything else as JSON.  Raises
+    ValueError if the profile names a setting TncState does not know or
+    gives one a value of the wrong type or out of range (see
+    TncState.check()).  null values are kept; apply() ignores them."""
+    with open(filename) as f:
+        if filename.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ImportError("PyYAML is required to read %s" % filename)
+            profile = yaml.safe_load(f)
+        else:
+            profile = json.load(f)
+    if not isinstance(profile, dict):
+        raise ValueError("%s does not contain a mapping of settings" % filename)
+    unknown = [name for name in profile if name not in TncState.SETTINGS]
+    if unknown:
+        raise ValueError("Unknown setting(s) in %s: %s" %
+            (filename, ', '.join(sorted(unknown))))
+    checked = {}
+    for name, value in profile.items():
+        if value is not None:
+            try:
+                value = TncState.check(name, value)
+            except ValueError as e:
+                raise ValueError("%s: %s" % (filename, e))
+        checked[name] = value
+    return checked
+
+
+def apply_profile(device, profile, save=True):
+    """Connect to the TNC on device, bring its settings to profile and
+    disconnect again.  Returns a dict with the settings that were changed
+    ('changes'), the settings in profile that the TNC does not support
+    and were skipped ('unsupported'), whether the changes were saved to
+    EEPROM ('saved'), the
+    firmware version and serial number reported by the TNC and the time
+    taken ('elapsed').  Raises the first error encountered."""
+    start = clock()
+    app = HeadlessApp()
+    tnc = TncModel(app, device)
+    tnc.idle_add = call_now
+    tnc.stream_on_connect = False
+    try:
+        tnc.connect()
+        app.check()
+        # handshake() returns on the capabilities reply; the battery level
+        # and any stragglers may still be on their way.
+        tnc.wait_quiet()
+        unsupported = tnc.unsupported(profile)
+        changes = tnc.apply(profile)
+        saved = False
+        # changes only holds settings the TNC reported, so a TNC that is
+        # already configured is not written to EEPROM again.
+        if changes and save and (tnc.state.capabilities or 0) & tnc.CAP_EEPROM_SAVE:
+            tnc.save_eeprom_settings()
+            saved = True
+        app.check()
+        state = tnc.state
+        result = dict(
+            device = device,
+            changes = dict(changes),
+            unsupported = unsupported,
+            saved = saved,
+            firmware_version = state.firmware_version,
+            serial_number = state.serial_number)
+    finally:
+        # Stopping the command writer flushes the queued commands.
+        tnc.disconnect()
+    app.check()
+    result['elapsed'] = clock() - start
+    return result
+
+
+MAX_WORKERS = 64
+
+def apply_fleet(devices, profile, save=True, max_workers=None):
+    """Apply profile to each of devices in parallel, using up to
+    max_workers threads (by default one per device, up to MAX_WORKERS).
+    Returns a list of result dicts in the order of devices.  Each has the
+    keys returned by apply_profile(), with 'success' set, or for a device
+    that failed 'success' False, 'error' and 'elapsed'."""
+    devices = list(devices)
+    if max_workers is None:
+        max_workers = min(len(devices), MAX_WORKERS)
+
+    def run(device):
+        start = clock()
+        try:
+            result = apply_profile(device, profile, save)
+            result['success'] = True
+        except Exception as e:
+            result = dict(device = device, success = False, error = str(e),
+                elapsed = clock() - start)
+        return result
+
+    if not devices:
+        return []
+    with futures.ThreadPoolExecutor(max(1, max_workers)) as executor:
+        return list(executor.map(run, devices))
+
+
+def write_report(results, f, elapsed=None):
+    """Write results from apply_fleet() to f as a JSON report."""
+    report = dict(
+        devices = len(results),
+        succeeded = sum(1 for r in results if r['success']),
+        changed = sum(1 for r in results if r.get('changes')),
+        results = results)
+    if elapsed is not None:
+        report['elapsed'] = elapsed
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.write('\n')
+
+
+def describe(result):
+    """Return a one line summary of a result from apply_fleet()."""
+    device = result['device']
+    if not result['success']:
+        return "%s: %s" % (device, result['error'])
+    changes = result['changes']
+    unsupported = result.get('unsupported')
+    skipped = "; unsupported: %s" % ', '.join(unsupported) if unsupported else ""
+    if not changes:
+        return "%s: no changes%s" % (device, skipped)
+    return "%s: changed %s%s%s" % (device,
+        ', '.join('%s=%s' % (k, changes[k]) for k in sorted(changes)),
+        " (saved)" if result['saved'] else "", skipped)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Apply a settings profile to one or more Mobilinkd TNCs.")
+    parser.add_argument('profile', help="JSON or YAML settings profile")
+    parser.add_argument('devices', metavar='device', nargs='+',
+        help="serial port of a TNC")
+    parser.add_argument('--no-save', dest='save', action='store_false',
+        help="do not save the changed settings to EEPROM")
+    parser.add_argument('--workers', type=int, default=None,
+        help="number of TNCs to configure at once (default: all)")
+    parser.add_argument('--report', metavar='FILE',
+        help="write a JSON report of the results to FILE ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        profile = load_profile(args.profile)
+    except Exception as e:
+        print("%s: %s" % (args.profile, e), file=sys.stderr)
+        return 2
+
+    start = clock()
+    results = apply_fleet(args.devices, profile, args.save, args.workers)
+    elapsed = clock() - start
+
+    # Keep stdout for the report when it is written there.
+    out = sys.stderr if args.report == '-' else sys.stdout
+    for result in results:
+        print(describe(result), file=out if result['success'] else sys.stderr)
+    failed = sum(1 for r in results if not r['success'])
+    if len(results) > 1:
+        print("%d of %d TNCs configured in %.1fs" %
+            (len(results) - failed, len(results), elapsed), file=out)
+
+    if args.report == '-':
+        write_report(results, sys.stdout, elapsed)
+    elif args.report:
+        with open(args.report, 'w') as f:
+            write_report(results, f, elapsed)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -67,10 +67,12 @@ if freeze:
     )]
     scripts = None
 else:
-    scripts = ['TncConfigApp.py']
+    scripts = ['TncConfigApp.py', 'TncDiscovery.py', 'TncFlasher.py', 'TncProfile.py']
     executables = None
 
-py_modules = ['Avr109', 'BootLoader', 'IntelHexRecord', 'TncModel']
+py_modules = ['Avr109', 'AsyncTncModel', 'BootLoader', 'IntelHexRecord', 'PortWatcher',
+    'SessionRecorder', 'SessionReplay', 'SimulatedBootLoader', 'SimulatedTnc', 'TncDiscovery',
+    'TncFlasher', 'TncMetrics', 'TncModel', 'TncProfile']
 
 buildOptions = dict(
     includes = ["gi"],
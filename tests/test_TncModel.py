@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from TncModel import HeadlessApp, KissData, TncModel, TncState, call_now
+
+
+class InputTwistTest(unittest.TestCase):
+
+    def test_negative_twist_round_trip(self):
+        """A TNC reporting an input twist of -3 has nothing to change for
+        a profile with -3."""
+        model = TncModel(HeadlessApp(), None)
+        model.idle_add = call_now
+        model.handle_packet(KissData(
+            6, TncModel.HANDLE_INPUT_TWIST, bytearray(b'\xfd'), True))
+        self.assertEqual(model.state.input_twist, -3)
+        self.assertEqual(model.state.diff({'input_twist': -3}), {})
+
+
+
+class SettingCheckTest(unittest.TestCase):
+
+    def test_valid_values(self):
+        self.assertIs(TncState.check('passall', 1), True)
+        self.assertEqual(TncState.check('input_twist', -3), -3)
+
+    def test_invalid_values(self):
+        for name, value in [('passall', 'false'), ('duplex', 2),
+                ('tx_delay', 256), ('tx_delay', True), ('tx_delay', 4.5),
+                ('input_twist', -129), ('no_such_setting', 1)]:
+            self.assertRaises(ValueError, TncState.check, name, value)
+
+
+if __name__ == '__main__':
+    unittest.main()